@@ -29,18 +29,97 @@
 
 import json
 import logging
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 import os
+import shutil
+import tempfile
+import time
 from functools import wraps
-from flask import Response, render_template, request, Flask, send_file, jsonify, redirect, url_for, make_response
+from flask import g, Blueprint, Response, current_app, render_template, request, Flask, send_file, jsonify, redirect, url_for, make_response, stream_with_context
 from flask_cors import CORS
-from tools.database import DataBase
-from tools.passwd import hash_password, verify_password, rand_hash
-from sqlite3 import IntegrityError
+from werkzeug.local import LocalProxy
+from tools.attendance import LessonJournal
+from tools.cache import FragmentCache, make_cache
+from tools.roster import RosterImport, normalize_name
+from tools.export import EXPORTS, csv_chunks, gzip_chunks, json_chunks
+from tools.metrics import Metrics
+from tools.database import DataBase, INSERTED, DUPLICATE, REJECTED
+from tools.sessions import make_store
+from tools.sync import SyncBatch
+from tools.passwd import KdfBusy, KdfPool, rand_hash
+from tools.tenants import Shards
 
 HOME_DIR = os.path.dirname(os.path.realpath(__file__))
-app = Flask(__name__, static_folder=os.path.realpath("{}/mods".format(HOME_DIR)))
+# Routes of the application, registered on every app create_app builds.
+views = Blueprint('fesmoorique', __name__)
+log = logging.getLogger('fesmoorique')
 
-auth_cookies = dict()
+# Storage settings, passed as is to DataBase. Writes of all threads are
+# committed together by one writer, write_delay is how long it gathers them.
+DB_CONFIG = {
+    'basefile': os.environ.get('FESMOORIQUE_DB', 'data.sqlite'),
+    'pool_size': int(os.environ.get('FESMOORIQUE_DB_POOL_SIZE', 8)),
+    'write_delay': int(os.environ.get('FESMOORIQUE_WRITE_DELAY_MS', 0)) / 1000,
+    'pragmas': {
+        'synchronous': os.environ.get('FESMOORIQUE_DB_SYNCHRONOUS', 'NORMAL'),
+    },
+}
+
+# Password hashing. Checks run in KDF_CONFIG['workers'] processes, logins
+# beyond max_pending waiting checks get a fast 503. Changing iterations
+# rehashes passwords on their next successful login.
+KDF_CONFIG = {
+    'workers': int(os.environ.get('FESMOORIQUE_KDF_WORKERS', 2)),
+    'max_pending': int(os.environ.get('FESMOORIQUE_KDF_QUEUE', 16)),
+    'iterations': int(os.environ.get('FESMOORIQUE_KDF_ITERATIONS', 100000)),
+}
+
+# Rows per page of group and student listings.
+PAGE_SIZE = int(os.environ.get('FESMOORIQUE_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = 1000
+
+# Rendered pages kept in memory by each worker. Page versions are 'memory'
+# for a single worker or 'sqlite' to invalidate pages of all workers.
+PAGE_CACHE_CONFIG = {
+    'max_entries': int(os.environ.get('FESMOORIQUE_PAGE_CACHE_SIZE', 2000)),
+    'versions': os.environ.get('FESMOORIQUE_PAGE_VERSIONS', 'memory'),
+}
+
+# Compiled templates are kept on disk for the next worker, None keeps them
+# in the system temp directory. Rendered table rows of groups are cached
+# by each worker.
+TEMPLATE_CACHE_DIR = os.environ.get('FESMOORIQUE_TEMPLATE_CACHE') or None
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FESMOORIQUE_FRAGMENT_CACHE_SIZE', 20000))
+
+# Log level of the application and request/query timings served on
+# /metrics in Prometheus text format.
+LOG_LEVEL = os.environ.get('FESMOORIQUE_LOG_LEVEL', 'INFO')
+METRICS_ENABLED = os.environ.get('FESMOORIQUE_METRICS', '1') == '1'
+
+# Users allowed to list the groups of every tenant, comma separated.
+ADMINS = set(filter(None, os.environ.get('FESMOORIQUE_ADMINS', '').split(',')))
+
+# Session backend, 'memory' for a single worker or 'sqlite' to share
+# logins between worker processes.
+SESSION_CONFIG = {
+    'backend': os.environ.get('FESMOORIQUE_SESSIONS', 'memory'),
+    'basefile': os.environ.get('FESMOORIQUE_SESSION_DB', 'sessions.sqlite'),
+    'ttl': int(os.environ.get('FESMOORIQUE_SESSION_TTL', 12 * 60 * 60)),
+}
+
+
+def _service(name):
+    return LocalProxy(lambda: current_app.extensions['fesmoorique'][name])
+
+# Services of the app handling the request, opened by create_app.
+directory = _service('directory')
+shards = _service('shards')
+sessions = _service('sessions')
+kdf = _service('kdf')
+page_cache = _service('page_cache')
+fragments = _service('fragments')
+metrics = _service('metrics')
 
 
 def is_authorized(name):
@@ -48,105 +127,340 @@ def is_authorized(name):
         @wraps(f)
         def wrapped(*args, **kwargs):
             if 'auth' not in request.cookies:
-                return redirect(url_for('login'))
-            try:
-                cookie = request.cookies['auth']
-                user = auth_cookies[cookie]
-            except:
-                return redirect(url_for('login'))
+                return redirect(url_for('.login'))
+            session = sessions.get(request.cookies['auth'])
+            if session is None:
+                return redirect(url_for('.login'))
+            g.user = {
+              'name': session['user_name'],
+              'id': session['user_id']
+            }
+            g.db = shards.get(session.get('tenant_id'))
+            if not metrics.enabled:
+                return f(*args, **kwargs)
+            started = time.perf_counter()
             ret = f(*args, **kwargs)
+            metrics.observe(
+                'fesmoorique_request_seconds', (('route', name),),
+                time.perf_counter() - started)
             return ret
         return wrapped
     return decorator
 
-@app.route("/", methods = ['POST', 'GET'])
+def cached_page(tags):
+    """Serve GET responses of the view from page_cache with an ETag, and
+    answer 304 when the browser already has the current version. `tags`
+    maps the view arguments to the cache tags the page depends on."""
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            etag = page_cache.etag(
+                (g.user['id'], request.full_path), tags(*args, **kwargs))
+            if request.if_none_match.contains(etag):
+                page_cache.count('not_modified')
+                resp = Response(status=304)
+            else:
+                body = page_cache.get(etag)
+                if body is None:
+                    resp = make_response(f(*args, **kwargs))
+                    if resp.status_code != 200:
+                        return resp
+                    page_cache.set(etag, resp.get_data())
+                else:
+                    resp = Response(body, mimetype='text/html')
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        return wrapped
+    return decorator
+
+@views.app_template_global()
+def group_fragments(template, rows, group=2, favourite=None):
+    """Render `template` once per group listing row, given as `row`.
+    Rows of a group whose version didn't change since are reused. The
+    versions of all groups on the page are read at once.
+    :param group: column of the group ID
+    :param favourite: column of the user's favourite flag, if the template
+      shows it"""
+    versions = page_cache.versions.get(
+        tuple(f'group:{row[group]}' for row in rows))
+    compiled = current_app.jinja_env.get_template(template)
+    return [Markup(fragments.render(
+        (g.db.basefile, template, row[group], version,
+         favourite is not None and bool(row[favourite])),
+        lambda: compiled.render(row=row)))
+        for row, (_, version) in zip(rows, versions)]
+
+@views.app_template_global()
+def group_fragment(template, group_id, **context):
+    """Render `template` showing one group, reused until the group
+    changes."""
+    tag = f'group:{int(group_id)}'
+    (_, version), = page_cache.versions.get((tag,))
+    return Markup(fragments.render(
+        (g.db.basefile, template, tag, version),
+        lambda: render_template(template, **context)))
+
+def roster_changed(db, group_name):
+    """Invalidate cached pages showing the roster of a group stored in
+    `db`."""
+    tags = ['groups']
+    group_id = db.find_group(group_name)
+    if group_id is not None:
+        tags.append(f'group:{group_id}')
+    page_cache.bump(*tags)
+
+def read_members(text):
+    """Split textarea input into normalized member names, one per line."""
+    members = (normalize_name(line) for line in text.split('\n'))
+    return [m for m in members if m]
+
+def summarize(outcomes):
+    """Count DataBase.add_group outcomes by kind."""
+    summary = {INSERTED: 0, DUPLICATE: 0, REJECTED: 0}
+    for _, outcome in outcomes:
+        summary[outcome] += 1
+    return summary
+
+def page_args():
+    """Cursor and page size of a listing request."""
+    after = request.args.get('after', '')
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        limit = PAGE_SIZE
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+def paginate(rows, limit):
+    """Split the result of a query for limit + 1 rows into the page and the
+    cursor of the next one, None on the last page. Listings are keyed by
+    the name in the first column."""
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1][0]
+    return rows, None
+
+@views.route("/", methods = ['POST', 'GET'])
 @is_authorized('index')
+@cached_page(lambda: ('groups', f"dashboard:{g.user['id']}"))
 def index():
-    cookie = request.cookies['auth']
-    user = {
-      'name': auth_cookies[cookie]['user_name'],
-      'id': auth_cookies[cookie]['user_id']
-    }
-    dashboard_list = db.get_dashboard(user=user['id'])
+    user = g.user
+    dashboard_list = g.db.get_dashboard(user=user['id'])
     return render_template('index.html', user=user, dashboard_list=dashboard_list)
 
-@app.route("/details_group/<group_id>")
+@views.route("/details_group/<int:group_id>")
 @is_authorized('details_group')
+@cached_page(lambda group_id: (f'group:{group_id}',))
 def details_group(group_id):
+    after, limit = page_args()
     try:
-        details = db.get_group(group_id)
+        details, next_after = paginate(
+            g.db.get_group(group_id, after, limit + 1), limit)
     except:
         return Response('Ошибка')
     if len(details) == 0:
         return Response('Такой группы нет.')
-    return render_template("details_group.html", details=details)
+    return render_template(
+        "details_group.html",
+        details=details,
+        group_id=group_id,
+        next_after=next_after)
+
+@views.route("/report/<int:group_id>")
+@is_authorized('report_group')
+def report_group(group_id):
+    details = g.db.get_group(group_id, limit=1)
+    if len(details) == 0:
+        return Response('Такой группы нет.')
+    weeks, terms = g.db.group_report(group_id)
+    return render_template(
+        "report_group.html",
+        group_name=details[0][2],
+        weeks=weeks,
+        terms=terms)
 
-@app.route("/actions/add_group", methods = ['POST', 'GET'])
+@views.route("/actions/add_group", methods = ['POST', 'GET'])
 @is_authorized('add_group')
+@cached_page(lambda: ('groups', f"dashboard:{g.user['id']}"))
 def add_group():
-    cookie = request.cookies['auth']
-    user = {
-      'name': auth_cookies[cookie]['user_name'],
-      'id': auth_cookies[cookie]['user_id']
-    }
+    user = g.user
     if request.method == 'POST':
         try:
             data = request.form
             group_id = data['group_id'].upper()
-            members = data["members"]
-            members = members.split('\n')
-            members = list(map(lambda z: z.rstrip(), members))
-            for i in range(0, len(members)):
-                members[i] = " ".join(list(map(lambda z: z.capitalize(), members[i].split())))
-            print('Going to add %s' % len(members))
-            print(members)
-            db.add_group(group_id, members, user['id'])
-            resp = make_response(redirect(url_for('index')))
-            return resp
+            members = read_members(data["members"])
+            log.debug('Going to add %s members to %s', len(members), group_id)
+            outcomes = g.db.add_group(group_id, members, user['id'])
+            roster_changed(g.db, group_id)
+            return render_template(
+                "ingest_report.html",
+                group_id=group_id,
+                outcomes=outcomes,
+                summary=summarize(outcomes))
         except Exception as e:
             return Response(f'Все сломалось. - {e}')
     else:
-        group_list = db.group_list(user=user['id'], favourites=True)
-        return render_template("add_group.html", group_list=group_list)
+        after, limit = page_args()
+        group_list, next_after = paginate(
+            g.db.group_list(user=user['id'], favourites=True,
+                          after=after, limit=limit + 1),
+            limit)
+        return render_template(
+            "add_group.html",
+            group_list=group_list,
+            next_after=next_after)
 
-@app.route("/actions/add_subject", methods = ['POST', 'GET'])
+@views.route("/actions/import_roster", methods = ['POST'])
+@is_authorized('import_roster')
+def import_roster():
+    upload = request.files.get('roster')
+    if upload is None:
+        return Response('Файл не выбран.', status=400)
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(upload.stream, f)
+    db = g.db
+    db.prune_imports(time.time() - 3600)
+    job_id = rand_hash()
+    app = current_app._get_current_object()
+    def on_batch(groups):
+        # Runs in the import thread, outside of this request.
+        with app.app_context():
+            for group in groups:
+                roster_changed(db, group)
+    RosterImport(db, path, g.user['id'], job_id, on_batch=on_batch).start()
+    return render_template("import_roster.html", job_id=job_id)
+
+@views.route("/actions/import_roster/<job_id>")
+@is_authorized('import_roster_status')
+def import_roster_status(job_id):
+    report = g.db.get_import(job_id, g.user['id'])
+    if report is None:
+        return jsonify(message='No such import.'), 404
+    return jsonify(report)
+
+@views.route("/api/groups")
+@is_authorized('api_groups')
+def api_groups():
+    after, limit = page_args()
+    rows, next_after = paginate(
+        g.db.group_list(user=g.user['id'], favourites=True,
+                      after=after, limit=limit + 1),
+        limit)
+    return jsonify(
+        items=[{
+            'name': name,
+            'reg_date': reg_date,
+            'id': group_id,
+            'members': members,
+            'author': author,
+            'favourite': favourite is not None,
+        } for name, reg_date, group_id, members, author, favourite in rows],
+        next=next_after)
+
+@views.route("/api/search")
+@is_authorized('api_search')
+def api_search():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    rows = g.db.search_students(request.args.get('q', '')[:64], limit)
+    return jsonify(items=[{
+        'id': student_id,
+        'name': name,
+        'group_id': group_id,
+        'group': group_name,
+    } for student_id, name, group_id, group_name in rows])
+
+@views.route("/api/groups/<int:group_id>/students")
+@is_authorized('api_group_students')
+def api_group_students(group_id):
+    after, limit = page_args()
+    rows, next_after = paginate(
+        g.db.get_group(group_id, after, limit + 1), limit)
+    return jsonify(
+        items=[{
+            'name': name,
+            'reg_date': reg_date,
+            'id': student_id,
+        } for name, reg_date, _, student_id in rows],
+        next=next_after)
+
+@views.route("/api/admin/groups")
+@is_authorized('api_admin_groups')
+def api_admin_groups():
+    if g.user['name'] not in ADMINS:
+        return jsonify(message='Admins only.'), 403
+    after, limit = page_args()
+    rows, cursor = shards.group_list(
+        after, request.args.get('after_tenant', ''), limit)
+    return jsonify(
+        items=[{
+            'tenant': tenant,
+            'name': name,
+            'reg_date': reg_date,
+            'id': group_id,
+            'members': members,
+            'author': author,
+        } for tenant, name, reg_date, group_id, members, author in rows],
+        next=cursor and {'after': cursor[0], 'after_tenant': cursor[1]})
+
+@views.route("/api/sync", methods = ['POST'])
+@is_authorized('api_sync')
+def api_sync():
+    data = request.get_json(silent=True)
+    try:
+        batch = SyncBatch(
+            data.get('ops') if isinstance(data, dict) else None, g.user['id'])
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    results = g.db.sync(batch)
+    if batch.tags:
+        page_cache.bump(*batch.tags)
+    return jsonify(results=results)
+
+@views.route("/actions/add_subject", methods = ['POST', 'GET'])
 @is_authorized('add_subject')
 def add_subject():
-    cookie = request.cookies['auth']
-    user = {
-      'name': auth_cookies[cookie]['user_name'],
-      'id': auth_cookies[cookie]['user_id']
-    }
+    user = g.user
     if request.method == 'POST':
         try:
             data = request.form
             group_id = data['group_id'].upper()
-            members = data["members"]
-            members = members.split('\n')
-            members = list(map(lambda z: z.rstrip(), members))
-            for i in range(0, len(members)):
-                members[i] = " ".join(list(map(lambda z: z.capitalize(), members[i].split())))
-            print('Going to add %s' % len(members))
-            print(members)
-            db.add_group(group_id, members, user['id'])
-            resp = make_response(redirect(url_for('index')))
-            return resp
+            members = read_members(data["members"])
+            log.debug('Going to add %s members to %s', len(members), group_id)
+            outcomes = g.db.add_group(group_id, members, user['id'])
+            roster_changed(g.db, group_id)
+            return render_template(
+                "ingest_report.html",
+                group_id=group_id,
+                outcomes=outcomes,
+                summary=summarize(outcomes))
         except Exception as e:
             return Response(f'Все сломалось. - {e}')
     else:
-        subject_list = db.subject_list(user=user['id'])
+        subject_list = g.db.subject_list(user=user['id'])
         return render_template("add_subject.html", subject_list=subject_list)
 
-@app.route("/actions/start_lesson/<group_id>/<subject_id>")
+@views.route("/actions/start_lesson/<int:group_id>/<subject_id>", methods = ['POST', 'GET'])
 @is_authorized('start_lesson')
+@cached_page(lambda group_id, subject_id: (f'group:{group_id}', 'subjects'))
 def start_lesson(group_id, subject_id):
-    cookie = request.cookies['auth']
-    user = {
-      'name': auth_cookies[cookie]['user_name'],
-      'id': auth_cookies[cookie]['user_id']
-    }
-    subject_list = db.subject_list(user=user['id'])
-    group_details = db.get_group(group_id)
+    user = g.user
+    if request.method == 'POST':
+        journal = LessonJournal(group_id, subject_id, user['id'])
+        try:
+            journal.mark_all(
+                request.form.getlist('student'),
+                request.form.getlist('present'))
+            g.db.save_lesson(journal)
+        except Exception as e:
+            return Response(f'Все сломалось. - {e}')
+        return redirect(url_for('.index'))
+    subject_list = g.db.subject_list(user=user['id'])
+    group_details = g.db.get_group(group_id)
     subject_details = (None, None, None)
     if subject_id == 'select_subject':
         return render_template(
@@ -157,7 +471,7 @@ def start_lesson(group_id, subject_id):
             subject_list=subject_list,
             subject_id=subject_id)
     else:
-        subject_details = db.get_subject(subject_id)
+        subject_details = g.db.get_subject(subject_id)
         return render_template(
             "start_lesson.html",
             user=user,
@@ -167,72 +481,172 @@ def start_lesson(group_id, subject_id):
             group_details=group_details,
             subject_id=subject_id)
 
-@app.route("/actions/add_to_favourite/<_id>")
+@views.route("/actions/add_to_favourite/<int:_id>")
 @is_authorized('add_to_favourite')
 def add_to_favourite(_id):
-    cookie = request.cookies['auth']
-    user = {
-      'name': auth_cookies[cookie]['user_name'],
-      'id': auth_cookies[cookie]['user_id']
-    }
-    db.add_to_favourites(group_id=_id, user_id=user['id'])
-    resp = make_response(redirect(url_for('add_group')))
+    user = g.user
+    g.db.add_to_favourites(group_id=_id, user_id=user['id'])
+    page_cache.bump(f"dashboard:{user['id']}")
+    resp = make_response(redirect(url_for('.add_group')))
     return resp
 
-@app.route("/actions/remove_from_favourite/<_id>")
+@views.route("/actions/remove_from_favourite/<int:_id>")
 @is_authorized('remove_from_favourite')
 def remove_from_favourite(_id):
-    cookie = request.cookies['auth']
-    user = {
-      'name': auth_cookies[cookie]['user_name'],
-      'id': auth_cookies[cookie]['user_id']
-    }
-    db.remove_from_favourites(group_id=_id, user_id=user['id'])
-    resp = make_response(redirect(url_for('add_group')))
+    user = g.user
+    g.db.remove_from_favourites(group_id=_id, user_id=user['id'])
+    page_cache.bump(f"dashboard:{user['id']}")
+    resp = make_response(redirect(url_for('.add_group')))
     return resp
 
-@app.route("/login", methods = ['POST', 'GET'])
+@views.route("/export/<table>.<fmt>")
+@is_authorized('export')
+def export(table, fmt):
+    if table not in EXPORTS or fmt not in ('csv', 'json'):
+        return Response('Нет такой выгрузки.', status=404)
+    name, columns = EXPORTS[table]
+    params = ()
+    if table == 'students' and 'group' in request.args:
+        name, params = 'export_group_students', (request.args['group'],)
+    chunks = g.db.stream(name, params)
+    body = csv_chunks(columns, chunks) if fmt == 'csv' else json_chunks(columns, chunks)
+    headers = {'Content-Disposition': f'attachment; filename={table}.{fmt}',
+               'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+@views.route("/stats")
+@is_authorized('stats')
+def stats():
+    tenants = shards.tenants()
+    return jsonify(
+        db_pool={name: db.pool.stats for name, db in tenants},
+        db_writer={name: db.writer.stats for name, db in tenants},
+        kdf=kdf.stats,
+        page_cache=page_cache.stats,
+        fragments=fragments.stats)
+
+@views.route("/metrics")
+def metrics_text():
+    if not metrics.enabled:
+        return Response('Metrics are disabled.', status=404)
+    gauges = []
+    sources = [('kdf', kdf.stats, ()), ('page_cache', page_cache.stats, ()),
+               ('fragments', fragments.stats, ())]
+    for name, db in shards.tenants():
+        sources.append(('db_pool', db.pool.stats, (('tenant', name),)))
+        sources.append(('db_writer', db.writer.stats, (('tenant', name),)))
+    for source, stats, labels in sources:
+        for key, value in stats.items():
+            gauges.append((f'fesmoorique_{source}_{key}', labels, value))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@views.route("/login", methods = ['POST', 'GET'])
 def login():
     if request.method == 'POST':
         data = request.form
         try:
             name = data['username'].lower()
             pass_ = data['password']
-            pass_hash = hash_password(pass_)
-            stored_hash, user_id = db.login(name=name)
-            if stored_hash:
-                if verify_password(stored_hash, pass_):
-                    cookie = rand_hash()
-                    resp = make_response(redirect(url_for('index')))
-                    resp.set_cookie('auth', cookie)
-                    auth_cookies[cookie] = dict()
-                    auth_cookies[cookie]['user_name'] = name
-                    auth_cookies[cookie]['user_id'] = user_id
-                    return resp
-            else:
-                return Response('Неверный пароль или имя пользователя. Try again baby.<br><a href="/login">Назад</a>')
-        except IntegrityError as e:
-            return jsonify(message="Username isn't available.", exception=e)
         except KeyError as e:
-            return jsonify(message="Lack of parameters.", exception=e)
-        return jsonify(message="User %s created." % name)
+            return jsonify(message="Lack of parameters.", exception=str(e))
+        account = directory.login(name=name)
+        stored_hash, user_id, tenant_id = account if account else (kdf.dummy_hash, None, None)
+        try:
+            valid, new_hash = kdf.check(stored_hash, pass_)
+        except KdfBusy:
+            resp = Response('Сервер занят, попробуйте еще раз.<br><a href="/login">Назад</a>', status=503)
+            resp.headers['Retry-After'] = '1'
+            return resp
+        if not (valid and account):
+            return Response('Неверный пароль или имя пользователя. Try again baby.<br><a href="/login">Назад</a>')
+        if new_hash:
+            directory.set_password(user_id, new_hash)
+        cookie = rand_hash()
+        resp = make_response(redirect(url_for('.index')))
+        resp.set_cookie('auth', cookie)
+        sessions.set(cookie, {'user_name': name, 'user_id': user_id,
+                              'tenant_id': tenant_id})
+        return resp
     else:
         return render_template("login.html")
 
-@app.route("/logout")
+@views.route("/logout")
 def logout():
     if 'auth' in request.cookies:
-        try:
-            del(auth_cookies[request.cookies['auth']])
-        except:
-            pass
-        return redirect(url_for('login'))
+        sessions.delete(request.cookies['auth'])
+        return redirect(url_for('.login'))
 
-if __name__ == "__main__":
-    db = DataBase(scheme=os.path.realpath("{}/data.sql".format(HOME_DIR)))
-    CORS(app)
+def create_app(db_config=None, session_config=None, kdf_config=None,
+               page_cache_config=None, metrics_enabled=None):
+    """
+      **Build an application.**
+      Opens the directory database, session store, password checker and
+      caches the views use, kept in app.extensions['fesmoorique']. Every
+      call builds a new app with its own services, see close_app. Call it
+      in every worker process, e.g. gunicorn 'app:create_app()', not in a
+      parent that forks workers afterwards. Omitted settings are taken from the environment.
+      :param db_config: DataBase arguments of the directory and every
+        tenant database, defaults to DB_CONFIG
+      :type db_config: dict
+      :param session_config: make_store arguments, defaults to SESSION_CONFIG
+      :type session_config: dict
+      :param kdf_config: KdfPool arguments, defaults to KDF_CONFIG
+      :type kdf_config: dict
+      :param page_cache_config: make_cache arguments, defaults to
+        PAGE_CACHE_CONFIG
+      :type page_cache_config: dict
+      :param metrics_enabled: defaults to METRICS_ENABLED
+      :type metrics_enabled: bool
+
+      :returns: Flask app
+    """
     logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log = logging.getLogger('fesmoorique')
-    app.run(host='0.0.0.0')
+        level=LOG_LEVEL,
+        format='%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s')
+    app = Flask(__name__, static_folder=os.path.realpath("{}/mods".format(HOME_DIR)))
+    CORS(app)
+    app.register_blueprint(views)
+    metrics = Metrics(
+        enabled=METRICS_ENABLED if metrics_enabled is None else metrics_enabled)
+    db_config = DB_CONFIG if db_config is None else db_config
+    scheme = os.path.realpath("{}/data.sql".format(HOME_DIR))
+    directory = DataBase(scheme=scheme, metrics=metrics, **db_config)
+    app.extensions['fesmoorique'] = {
+        'directory': directory,
+        'shards': Shards(directory, lambda basefile: DataBase(
+            scheme=scheme, metrics=metrics,
+            **dict(db_config, basefile=basefile))),
+        'sessions': make_store(
+            **(SESSION_CONFIG if session_config is None else session_config)),
+        'kdf': KdfPool(**(KDF_CONFIG if kdf_config is None else kdf_config)),
+        'page_cache': make_cache(
+            db=directory,
+            **(PAGE_CACHE_CONFIG if page_cache_config is None
+               else page_cache_config)),
+        'fragments': FragmentCache(FRAGMENT_CACHE_SIZE),
+        'metrics': metrics,
+    }
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+    log.info('Worker %s ready', os.getpid())
+    return app
+
+def close_app(app):
+    """
+      **Release what create_app opened for `app`.**
+      Commits queued writes, stops writer threads and password checking
+      processes and closes database connections.
+      :param app: Flask app built by create_app
+      :returns: None
+    """
+    services = app.extensions.pop('fesmoorique')
+    services['kdf'].shutdown()
+    services['shards'].close()
+    services['directory'].close()
+    services['sessions'].close()
+
+if __name__ == "__main__":
+    create_app().run(host='0.0.0.0', threaded=True)
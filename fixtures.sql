@@ -0,0 +1,24 @@
+BEGIN TRANSACTION;
+-- Test users
+INSERT OR IGNORE INTO "users"("name", "pass", "reg_date", "id") VALUES ('admin', 'bff2712a7379d2934f097438624a9ac40668a0769460ab9ded045316bdda4c97b265456aec47d24291440a85032a8e03b69c4d797e5501714039e9209c3ec49f720d798a0ac2399941c4755eeb5959cd2b027191ea6b226c980aa37542f916e1', '2019-06-24 11:09:23', 1);
+INSERT OR IGNORE INTO "users"("name", "pass", "reg_date", "id") VALUES ('admin1', 'ef7ac768eacc72c332c5ff349e272fea4cc3c81e27cbe8865e1d3e937f373a8404cf635939f8277ea05756bda67cad4a4a224dbea809f19e5164b067730e928dc4e9d7dbf95e13bdf3aee71a97f38bee3e119b332e571d21dd78872a153a19cf', '2019-06-24 11:09:23', 2);
+-- Test groups
+INSERT OR IGNORE INTO "groups"("name", "reg_date", "author", "id") VALUES ('DCP228', '2019-08-05 22:08:08', 1, 1);
+INSERT OR IGNORE INTO "groups"("name", "reg_date", "author", "id") VALUES ('ZPR1337', '2019-08-05 22:27:44', 1, 2);
+INSERT OR IGNORE INTO "groups"("name", "reg_date", "author", "id") VALUES ('GGWP1', '2019-08-05 23:02:14', 1, 3);
+-- test subjects
+INSERT OR IGNORE INTO "subjects"("name", "reg_date", "author", "id") VALUES ('Матан', '2019-08-05 22:27:44', 1, 1);
+INSERT OR IGNORE INTO "subjects"("name", "reg_date", "author", "id") VALUES ('Теология', '2019-08-05 23:02:14', 1, 2);
+INSERT OR IGNORE INTO "subjects"("name", "reg_date", "author", "id") VALUES ('Труд', '2019-08-05 23:02:14', 2, 3);
+-- Test students
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Pizda Ivanovna', 1, '2019-08-05 22:08:08', 1, 1);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Khui Petrovich', 1, '2019-08-05 22:08:08', 1, 2);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Gosha Khuev', 2, '2019-08-05 22:27:44', 1, 3);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Akhmed Allah', 2, '2019-08-05 22:27:44', 1, 4);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Pidor Ivanovich', 1, '2019-08-05 22:40:12', 1, 5);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Lox Ebany', 1, '2019-08-05 22:59:13', 1, 6);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Gena Pidor', 1, '2019-08-05 22:59:13', 1, 7);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Suka Blya', 3, '2019-08-05 23:02:14', 1, 8);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Govinko Zalupa', 3, '2019-08-05 23:02:14', 1, 9);
+INSERT OR IGNORE INTO "students"("name", "group", "reg_date", "author", "id") VALUES ('Aloah', 1, '2019-08-05 23:09:37', 2, 10);
+COMMIT;
@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: test_sync
+   :synopsis: Checks and replays of batched sync operations.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+"""
+
+import os
+
+import pytest
+
+from tools.database import DataBase
+from tools.sync import APPLIED, FAILED, REPLAYED, SyncBatch
+
+SCHEME = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data.sql')
+USER = 1
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DataBase(scheme=SCHEME, basefile=str(tmp_path / 'data.sqlite'))
+    db.add_groups({'G1': ['Ivan Petrov', 'Olga Sidorova']}, USER)
+    yield db
+    db.close()
+
+
+def sync(db, ops):
+    return db.sync(SyncBatch(ops, USER))
+
+
+def students(db, group='G1'):
+    return [name for name, *_ in db.get_group(db.find_group(group))]
+
+
+@pytest.mark.parametrize('op, error', [
+    ({'key': 'k', 'op': ['lesson']}, "unknown op ['lesson']"),
+    ({'key': 'k', 'op': 'nope'}, "unknown op 'nope'"),
+    ({'key': 'k', 'op': 'members', 'group': 5, 'members': []},
+     'group must be a group name'),
+    ({'key': 'k', 'op': 'members', 'group': ' ', 'members': []},
+     'group must be a group name'),
+    ({'key': 'k', 'op': 'members', 'group': 'G1', 'members': [None]},
+     'members must be a list of names'),
+    ({'key': 'k', 'op': 'members', 'group': 'G1', 'members': 'Ivan'},
+     'members must be a list of names'),
+    ({'key': 'k', 'op': 'favourite'}, "missing 'group_id'"),
+    ({'key': 'k', 'op': 'favourite', 'group_id': float('inf')}, None),
+    ({'key': 'k', 'op': 'lesson', 'group_id': 1, 'subject_id': 1,
+      'marks': [1]}, 'marks must map student IDs to true or false'),
+    ({'key': ['k'], 'op': 'favourite', 'group_id': 1}, None),
+    ('k', None),
+])
+def test_malformed_op_fails_alone(db, op, error):
+    ok = {'key': 'ok', 'op': 'members', 'group': 'g1', 'members': ['new kid']}
+    results = sync(db, [op, ok])
+    assert results[0]['status'] == FAILED
+    if error is not None:
+        assert results[0]['error'] == error
+    assert results[1]['status'] == APPLIED
+    assert 'None' not in students(db)
+    assert 'New Kid' in students(db)
+
+
+def test_batch_must_be_a_list(db):
+    with pytest.raises(ValueError):
+        SyncBatch({'key': 'k'}, USER)
+
+
+def test_retry_replays_stored_results(db):
+    group_id = db.find_group('G1')
+    student_ids = [row[3] for row in db.get_group(group_id)]
+    ops = [
+        {'key': 'l1', 'op': 'lesson', 'group_id': group_id, 'subject_id': 1,
+         'marks': {str(s): True for s in student_ids}},
+        {'key': 'm1', 'op': 'marks', 'lesson': 'l1',
+         'marks': {str(student_ids[0]): False}},
+        {'key': 'f1', 'op': 'favourite', 'group_id': group_id},
+        {'key': 'r1', 'op': 'members', 'group': 'G1',
+         'members': ['anna  kuznetsova']},
+    ]
+    first = sync(db, ops)
+    assert [r['status'] for r in first] == [APPLIED] * 4
+    assert first[0]['marked'] == 2 and first[1]['marked'] == 1
+    assert first[3]['outcomes'] == [['Anna Kuznetsova', 'inserted']]
+
+    again = sync(db, ops)
+    assert [r['status'] for r in again] == [REPLAYED] * 4
+    for before, after in zip(first, again):
+        assert dict(before, status=None) == dict(after, status=None)
+    with db.pool.connection() as conn:
+        rollup = conn.execute(
+            'SELECT present, total FROM attendance_lessons').fetchall()
+    assert rollup == [(1, 2)]
+    assert len(students(db)) == 3
+
+
+def test_keys_are_per_user(db):
+    group_id = db.find_group('G1')
+    op = {'key': 'same', 'op': 'favourite', 'group_id': group_id}
+    assert sync(db, [op])[0]['status'] == APPLIED
+    other = db.sync(SyncBatch([op], USER + 1))
+    assert other[0]['status'] == APPLIED
+
+
+def test_failed_write_is_rolled_back_and_not_stored(db):
+    ops = [{'key': 'm1', 'op': 'marks', 'lesson': 'missing', 'marks': {}}]
+    assert sync(db, ops)[0] == {
+        'key': 'm1', 'status': FAILED,
+        'error': "no lesson synced as 'missing'"}
+    assert sync(db, ops)[0]['status'] == FAILED
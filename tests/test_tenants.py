@@ -0,0 +1,93 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: test_tenants
+   :synopsis: Paging of the cross-tenant group listing.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+"""
+
+import os
+
+import pytest
+
+from tools.database import DataBase
+from tools.tenants import DEFAULT_TENANT, Shards
+
+SCHEME = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data.sql')
+
+
+@pytest.fixture
+def shards(tmp_path):
+    def open_db(basefile):
+        return DataBase(scheme=SCHEME, basefile=basefile)
+    shards = Shards(open_db(str(tmp_path / 'directory.sqlite')), open_db)
+    yield shards
+    shards.close()
+    shards.directory.close()
+
+
+def add_tenant(shards, name, groups):
+    tenant_id = shards.add_tenant(name, f'{name}.sqlite')
+    shards.get(tenant_id).add_groups({group: [] for group in groups}, 1)
+
+
+def walk(shards, limit):
+    """Every page of Shards.group_list as (tenant, group name) rows."""
+    listed, cursor, pages = [], ('', ''), 0
+    while cursor is not None:
+        rows, cursor = shards.group_list(*cursor, limit=limit)
+        listed += [(tenant, name) for tenant, name, *_ in rows]
+        pages += 1
+        assert pages <= 100
+    return listed
+
+
+@pytest.mark.parametrize('limit', [1, 3, 10, 11])
+def test_pages_of_one_tenant(shards, limit):
+    names = [f'G{i:02}' for i in range(10)]
+    shards.directory.add_groups({name: [] for name in names}, 1)
+    assert walk(shards, limit) == [(DEFAULT_TENANT, name) for name in names]
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 7, 50])
+def test_pages_of_two_tenants(shards, limit):
+    shards.directory.add_groups(
+        {name: [] for name in ('A1', 'B1', 'B2', 'C1', 'D1')}, 1)
+    add_tenant(shards, 'physics', ('A1', 'B1', 'B3', 'C0', 'C1', 'E1'))
+    expected = sorted(
+        [(DEFAULT_TENANT, n) for n in ('A1', 'B1', 'B2', 'C1', 'D1')] +
+        [('physics', n) for n in ('A1', 'B1', 'B3', 'C0', 'C1', 'E1')],
+        key=lambda row: (row[1], row[0]))
+    assert walk(shards, limit) == expected
+
+
+def test_default_tenant_name_is_reserved(shards):
+    with pytest.raises(ValueError):
+        shards.add_tenant(DEFAULT_TENANT, 'other.sqlite')
+    assert shards.directory.tenant_list() == []
+    assert [name for name, _ in shards.tenants()] == [DEFAULT_TENANT]
@@ -0,0 +1,74 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: attendance
+   :synopsis: Per-lesson journal of attendance marks.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+"""
+
+
+class LessonJournal:
+    """Attendance marks of one lesson. Marks are only collected here,
+    DataBase.save_lesson writes the lesson and all of its marks in a single
+    transaction. Marking a student again replaces the previous mark."""
+    def __init__(self, group_id, subject_id, author, lesson_id=None):
+        """
+          :param group_id: Group ID
+          :type group_id: int
+          :param subject_id: Subject ID
+          :type subject_id: int
+          :param author: User who marks the lesson
+          :type author: int
+          :param lesson_id: existing lesson to add marks to, a new lesson
+            is created on save when None
+          :type lesson_id: int
+        """
+        self.group_id = int(group_id)
+        self.subject_id = int(subject_id)
+        self.author = author
+        self.lesson_id = lesson_id
+        self.marks = dict()
+
+    def mark(self, student_id, present):
+        self.marks[int(student_id)] = 1 if present else 0
+
+    def mark_all(self, student_ids, present_ids):
+        """
+          Mark every student of `student_ids`, present when listed in
+          `present_ids` and absent otherwise.
+        """
+        present_ids = set(map(int, present_ids))
+        for student_id in student_ids:
+            self.mark(student_id, int(student_id) in present_ids)
+
+    def rows(self, lesson_id):
+        """Parameters for QUERIES['mark_student']."""
+        return [(lesson_id, present, student_id, self.group_id)
+                for student_id, present in self.marks.items()]
+
+    def __len__(self):
+        return len(self.marks)
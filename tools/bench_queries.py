@@ -0,0 +1,121 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: bench_queries
+   :synopsis: Micro-benchmark of registry statements against inline SQL.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Runs the hot lookups (login, get_group, get_dashboard) on one connection,
+once with values formatted into the SQL text the way DataBase used to do it
+and once with the bound statements from tools.queries.
+
+    $ python -m tools.bench_queries --rounds 20000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from tools.migrations import migrate
+from tools.queries import QUERIES
+
+# Old style statements, values are formatted into the text on every call.
+INLINE = {name: QUERIES[name].replace('?', '%r')
+          for name in ('login', 'get_group', 'get_dashboard')}
+
+
+def populate(conn, users, groups, students):
+    """Fill an empty database created from data.sql with synthetic rows."""
+    conn.execute("BEGIN")
+    conn.execute("DELETE FROM users")
+    conn.execute("DELETE FROM groups")
+    conn.execute("DELETE FROM students")
+    conn.executemany(
+        "INSERT INTO users(name, pass) VALUES (?, 'x')",
+        [(f'user{i}',) for i in range(users)])
+    conn.executemany(
+        "INSERT INTO groups(name, author) VALUES (?, 1)",
+        [(f'G{i}',) for i in range(groups)])
+    conn.executemany(
+        "INSERT INTO students(name, 'group', author) VALUES (?, ?, 1)",
+        [(f'student{i}', i % groups + 1) for i in range(students)])
+    conn.executemany(
+        "INSERT INTO dashboard(user_id, group_id) VALUES (?, ?)",
+        [(u + 1, (u * 7 + k) % groups + 1) for u in range(users) for k in range(3)])
+    conn.commit()
+
+
+def arguments(name, i, users, groups):
+    if name == 'login':
+        return (f'user{i % users}',)
+    if name == 'get_group':
+        return (i % groups + 1, '', 100)
+    return (i % users + 1,)
+
+
+def run(conn, name, rounds, users, groups, bound):
+    started = time.perf_counter()
+    for i in range(rounds):
+        args = arguments(name, i, users, groups)
+        if bound:
+            conn.execute(QUERIES[name], args).fetchall()
+        else:
+            conn.execute(INLINE[name] % args).fetchall()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare inline SQL with registry statements.')
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--students', type=int, default=5000)
+    args = parser.parse_args()
+
+    scheme = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))), 'data.sql')
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(
+            os.path.join(tmp, 'bench.sqlite'), isolation_level=None)
+        with open(scheme) as f:
+            conn.executescript(f.read())
+        migrate(conn)
+        populate(conn, args.users, args.groups, args.students)
+        print(f"{'query':<15}{'inline ops/s':>15}{'bound ops/s':>15}{'gain':>8}")
+        for name in INLINE:
+            inline = run(conn, name, args.rounds, args.users, args.groups, False)
+            bound = run(conn, name, args.rounds, args.users, args.groups, True)
+            print(f"{name:<15}{args.rounds / inline:>15.0f}"
+                  f"{args.rounds / bound:>15.0f}{inline / bound:>7.2f}x")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,443 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: bench_routes
+   :synopsis: Load test of every route with latency percentiles.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Drives the routes of app.py against a database filled by tools.seed, either
+in process through the Flask test client or over HTTP against a running
+server (--url). Each route gets --requests requests from --concurrency
+threads; p50/p95/p99 latency and throughput are printed per route and
+written as JSON together with the time it took to open the database
+(and build the app in process), and --baseline prints the change against an earlier run.
+
+    $ python -m tools.seed bench.sqlite
+    $ python -m tools.bench_routes bench.sqlite --concurrency 8 \\
+        --output bench.json
+    $ python -m tools.bench_routes bench.sqlite --baseline bench.json
+"""
+
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+HOME_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# Job id in the page answering a roster upload.
+JOB_ID = re.compile(r"/actions/import_roster/([^'/]+)'")
+
+
+class Dataset:
+    """Ids of the benchmark database the scenarios pick from."""
+    def __init__(self, db, user, password, rng):
+        account = db.login(user)
+        if not account:
+            raise SystemExit(f'No user {user}, seed the database first.')
+        self.user, self.password = user, password
+        self.user_id = account[1]
+        self.rng = rng
+        groups = db.group_list(limit=1000)
+        self.groups = [row[2] for row in groups]
+        self.group_names = [row[0] for row in groups]
+        self.subjects = [row[2] for row in db.subject_list(self.user_id)]
+        if not self.subjects:
+            raise SystemExit(f'User {user} has no subjects.')
+        self.jobs = []
+        self.batches = []
+        self.db = db
+        self.rosters = dict()
+
+    def group(self):
+        return self.rng.choice(self.groups)
+
+    def subject(self):
+        return self.rng.choice(self.subjects)
+
+    def marks(self, group_id):
+        """Form of a marking sheet with most of the group present."""
+        if group_id not in self.rosters:
+            self.rosters[group_id] = [
+                row[3] for row in self.db.get_group(group_id)]
+        students = self.rosters[group_id]
+        return {'student': students,
+                'present': [s for s in students if self.rng.random() < 0.8]}
+
+    def sync_batch(self, favourites=20):
+        """JSON body of /api/sync with new keys: a lesson of a group, a
+        correction of one mark and favourite toggles. Kept for replays."""
+        group_id = self.group()
+        form = self.marks(group_id)
+        present = set(form['present'])
+        lesson_key = uuid.uuid4().hex
+        ops = [{'key': lesson_key, 'op': 'lesson', 'group_id': group_id,
+                'subject_id': self.subject(),
+                'marks': {s: s in present for s in form['student']}}]
+        if form['student']:
+            ops.append({'key': uuid.uuid4().hex, 'op': 'marks',
+                        'lesson': lesson_key,
+                        'marks': {form['student'][0]: True}})
+        ops += [{'key': uuid.uuid4().hex, 'op': 'favourite',
+                 'group_id': self.group(),
+                 'favourite': self.rng.random() < 0.5}
+                for _ in range(favourites)]
+        body = json.dumps({'ops': ops})
+        self.batches.append(body)
+        return body
+
+
+def roster_csv(data):
+    return io.BytesIO('\n'.join(
+        f'{data.rng.choice(data.group_names)},Bench Student {uuid.uuid4().hex[:12]}'
+        for _ in range(20)).encode())
+
+
+# name -> (method, path, form, files), built from a Dataset for every
+# request. form is a dict of fields, or a string sent as a JSON body.
+# Write routes add rows, run them against a throwaway copy.
+SCENARIOS = {
+    'index': lambda d: ('GET', '/', None, None),
+    'details_group': lambda d: ('GET', f'/details_group/{d.group()}', None, None),
+    'report_group': lambda d: ('GET', f'/report/{d.group()}', None, None),
+    'add_group': lambda d: ('GET', '/actions/add_group', None, None),
+    'add_group_post': lambda d: ('POST', '/actions/add_group', {
+        'group_id': d.rng.choice(d.group_names),
+        'members': '\n'.join(f'Bench Student {uuid.uuid4().hex[:12]}'
+                             for _ in range(10))}, None),
+    'import_roster': lambda d: ('POST', '/actions/import_roster', None,
+                                {'roster': (roster_csv(d), 'roster.csv')}),
+    'import_roster_status': lambda d: (
+        'GET', f'/actions/import_roster/{d.rng.choice(d.jobs or ["none"])}',
+        None, None),
+    'api_groups': lambda d: ('GET', '/api/groups?limit=50', None, None),
+    'api_search': lambda d: (
+        'GET', '/api/search?' + urlencode({'q': d.rng.choice(
+            ('ivan', 'petrov', 'olga s', 'seed12', 'kuzn', 'vinogr'))}),
+        None, None),
+    'api_group_students': lambda d: (
+        'GET', f'/api/groups/{d.group()}/students', None, None),
+    'api_admin_groups': lambda d: (
+        'GET', '/api/admin/groups?limit=50', None, None),
+    'api_sync': lambda d: ('POST', '/api/sync', d.sync_batch(), None),
+    'api_sync_replay': lambda d: (
+        'POST', '/api/sync', d.rng.choice(d.batches), None),
+    'add_subject': lambda d: ('GET', '/actions/add_subject', None, None),
+    'start_lesson': lambda d: (
+        'GET', f'/actions/start_lesson/{d.group()}/{d.subject()}', None, None),
+    'start_lesson_post': lambda d: (lambda group_id: (
+        'POST', f'/actions/start_lesson/{group_id}/{d.subject()}',
+        d.marks(group_id), None))(d.group()),
+    'add_to_favourite': lambda d: (
+        'GET', f'/actions/add_to_favourite/{d.group()}', None, None),
+    'remove_from_favourite': lambda d: (
+        'GET', f'/actions/remove_from_favourite/{d.group()}', None, None),
+    'export_groups': lambda d: ('GET', '/export/groups.csv', None, None),
+    'export_group_students': lambda d: (
+        'GET', f'/export/students.json?group={d.group()}', None, None),
+    'stats': lambda d: ('GET', '/stats', None, None),
+    'metrics': lambda d: ('GET', '/metrics', None, None),
+    'login': lambda d: ('GET', '/login', None, None),
+    'login_post': lambda d: ('POST', '/login', {
+        'username': d.user, 'password': d.password}, None),
+    'logout': lambda d: ('GET', '/logout', None, None),
+}
+
+# Routes answering with a redirect on success.
+REDIRECTS = ('start_lesson_post', 'add_to_favourite', 'remove_from_favourite',
+             'login_post', 'logout')
+
+
+class AppClient:
+    """Requests through the Flask test client, one client per thread."""
+    def __init__(self, app, cookie):
+        self.app = app
+        self.cookie = cookie
+        self.local = threading.local()
+
+    def request(self, method, path, form=None, files=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+            client.set_cookie('auth', self.cookie)
+        if isinstance(form, str):
+            resp = client.open(path, method=method, data=form,
+                               content_type='application/json')
+        else:
+            data = dict(form or {}, **(files or {}))
+            resp = client.open(path, method=method, data=data)
+        body = resp.get_data()
+        resp.close()
+        return resp.status_code, body
+
+
+class HttpClient:
+    """Requests over keep-alive HTTP connections, one per thread."""
+    def __init__(self, url, cookie=None):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.cookie = cookie
+        self.local = threading.local()
+
+    def request(self, method, path, form=None, files=None):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=60)
+        headers = {'Cookie': f'auth={self.cookie}'} if self.cookie else {}
+        body = None
+        if files:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for name, value in (form or {}).items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                             f'name="{name}"\r\n\r\n{value}\r\n'.encode())
+            for name, (stream, filename) in files.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                             f'name="{name}"; filename="{filename}"\r\n'
+                             'Content-Type: text/csv\r\n\r\n'.encode())
+                parts.append(stream.read() + b'\r\n')
+            parts.append(f'--{boundary}--\r\n'.encode())
+            body = b''.join(parts)
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        elif isinstance(form, str):
+            body = form.encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form, doseq=True)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            raise
+        return resp.status, body
+
+    def login(self, user, password):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        conn.request('POST', '/login', body=urlencode(
+            {'username': user, 'password': password}), headers={
+            'Content-Type': 'application/x-www-form-urlencoded'})
+        resp = conn.getresponse()
+        resp.read()
+        conn.close()
+        for header in resp.headers.get_all('Set-Cookie') or []:
+            if header.startswith('auth='):
+                self.cookie = header.split(';')[0][len('auth='):]
+                return
+        raise SystemExit(f'Login as {user} failed: {resp.status}')
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def run_route(client, scenario, data, requests, concurrency, redirect):
+    """
+      :return: dict with request count, errors, status counts, latency
+        percentiles in milliseconds and throughput in requests per second.
+    """
+    latencies = []
+    statuses = dict()
+    lock = threading.Lock()
+
+    def one(_):
+        args = scenario(data)
+        started = time.perf_counter()
+        try:
+            status, _ = client.request(*args)
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    ok = (200, 302) if redirect else (200,)
+    return {
+        'requests': requests,
+        'errors': sum(n for s, n in statuses.items() if s not in ok),
+        'status': {str(s): n for s, n in sorted(statuses.items(), key=str)},
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'rps': round(requests / wall, 1),
+    }
+
+
+def in_process(basefile, admin=None):
+    """Build an app of app.py on `basefile` with in-memory sessions, `admin`
+    is added to FESMOORIQUE_ADMINS."""
+    if admin:
+        os.environ['FESMOORIQUE_ADMINS'] = ','.join(filter(None, (
+            os.environ.get('FESMOORIQUE_ADMINS'), admin)))
+    import app
+    return app.create_app(
+        db_config=dict(app.DB_CONFIG, basefile=basefile),
+        session_config=dict(app.SESSION_CONFIG, backend='memory'))
+
+
+def revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HOME_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    if baseline.get('startup_ms'):
+        print(f"\nstartup {baseline['startup_ms']:.2f} ms before, "
+              f"{results['startup_ms']:.2f} ms now")
+    print(f"\n{'route':<24}{'p95 before':>12}{'p95 now':>12}{'change':>9}")
+    for name, now in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if before is None or not before['p95_ms']:
+            continue
+        change = now['p95_ms'] / before['p95_ms'] - 1
+        print(f"{name:<24}{before['p95_ms']:>12.2f}{now['p95_ms']:>12.2f}"
+              f"{change:>+9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test fesmoorique routes.')
+    parser.add_argument('basefile', nargs='?', default='bench.sqlite',
+                        help='database filled by tools.seed')
+    parser.add_argument('--url', help='benchmark a running server instead, '
+                        'e.g. http://127.0.0.1:5000')
+    parser.add_argument('--routes', default=','.join(SCENARIOS),
+                        help='comma separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--user', default='seed0')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of an earlier run')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    routes = args.routes.split(',')
+    unknown = set(routes) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(sorted(unknown))}')
+
+    sys.path.insert(0, HOME_DIR)
+    application = None
+    started = time.perf_counter()
+    if args.url:
+        from tools.database import DataBase
+        db = DataBase(scheme=os.path.join(HOME_DIR, 'data.sql'),
+                      basefile=args.basefile)
+        startup = time.perf_counter() - started
+        data = Dataset(db, args.user, args.password, random.Random(args.seed))
+        client = HttpClient(args.url)
+        client.login(args.user, args.password)
+        if ('api_admin_groups' in routes and client.request(
+                *SCENARIOS['api_admin_groups'](data))[0] == 403):
+            print(f'Skipping api_admin_groups, {args.user} is not in '
+                  'FESMOORIQUE_ADMINS of the server')
+            routes.remove('api_admin_groups')
+    else:
+        application = in_process(args.basefile, admin=args.user)
+        startup = time.perf_counter() - started
+        services = application.extensions['fesmoorique']
+        db = services['directory']
+        data = Dataset(db, args.user, args.password, random.Random(args.seed))
+        cookie = uuid.uuid4().hex
+        services['sessions'].set(cookie, {'user_name': args.user,
+                                          'user_id': data.user_id})
+        client = AppClient(application, cookie)
+    if 'api_sync_replay' in routes:
+        client.request(*SCENARIOS['api_sync'](data))
+    if 'import_roster_status' in routes:
+        _, body = client.request(*SCENARIOS['import_roster'](data))
+        data.jobs = JOB_ID.findall(body.decode())
+
+    results = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': revision(),
+        'mode': args.url or 'test_client',
+        'basefile': os.path.realpath(args.basefile),
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'startup_ms': round(startup * 1000, 3),
+        'routes': dict(),
+    }
+    print(f"startup {results['startup_ms']:.2f} ms")
+    print(f"{'route':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'req/s':>9}{'errors':>8}")
+    try:
+        for name in routes:
+            result = run_route(client, SCENARIOS[name], data, args.requests,
+                               args.concurrency, name in REDIRECTS)
+            results['routes'][name] = result
+            print(f"{name:<24}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                  f"{result['p99_ms']:>9.2f}{result['rps']:>9.0f}"
+                  f"{result['errors']:>8}")
+    finally:
+        if application is not None:
+            from app import close_app
+            while db.running_imports():
+                time.sleep(0.1)
+            close_app(application)
+        else:
+            db.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
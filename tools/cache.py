@@ -0,0 +1,193 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: cache
+   :synopsis: Cache of rendered pages validated by write-driven versions.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Every page depends on a few tags such as ``groups`` or ``dashboard:1``.
+Writes bump the version of the tags they touch. A page is cached under an
+ETag computed from its key and the current versions of its tags, so a
+bumped tag makes both the cached body and the browser's copy stale without
+looking at the database. Bodies are kept by every worker process, the
+versions either in the process too or, when several workers serve the same
+database, in its page_versions table so a write seen by one worker
+invalidates the pages of all of them.
+
+Table rows of a group are cached the same way by FragmentCache, under the
+version of the group's tag, so a page missing the page cache still reuses
+the rows of every group that didn't change.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from tools.queries import QUERIES, page_versions
+
+
+class MemoryVersions:
+    """Tag versions of a single process."""
+    def __init__(self):
+        self._versions = dict()
+        self._lock = threading.Lock()
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def get(self, tags):
+        with self._lock:
+            return [(tag, self._versions.get(tag, 0)) for tag in tags]
+
+
+class SQLiteVersions:
+    """Tag versions in the application database, shared by workers."""
+    def __init__(self, db):
+        """
+          :param db: the application database
+          :type db: tools.database.DataBase
+        """
+        self.db = db
+
+    def bump(self, tags):
+        self.db.write(lambda conn: conn.executemany(
+            QUERIES['bump_page_version'], [(tag,) for tag in tags]))
+
+    def get(self, tags):
+        with self.db.pool.connection() as conn:
+            stored = dict(conn.execute(page_versions(len(tags)), tags))
+        return [(tag, stored.get(tag, 0)) for tag in tags]
+
+
+class PageCache:
+    """LRU cache of rendered page bodies keyed by ETag."""
+    def __init__(self, max_entries=2000, versions=None):
+        """
+          :param max_entries: bodies kept, least recently used are dropped
+          :type max_entries: int
+          :param versions: tag version store, MemoryVersions by default
+          :type versions: MemoryVersions or SQLiteVersions
+        """
+        self.max_entries = max_entries
+        self.versions = versions or MemoryVersions()
+        self.stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def bump(self, *tags):
+        """Invalidate every page depending on one of `tags`."""
+        self.versions.bump(tags)
+
+    def etag(self, key, tags):
+        """
+          :param key: identifies the page, e.g. user and path
+          :param tags: tags the page depends on
+          :type tags: tuple
+          :return: ETag of the current version of the page
+        """
+        versions = self.versions.get(tuple(tags))
+        return hashlib.sha1(repr((key, versions)).encode('utf-8')).hexdigest()
+
+    def get(self, etag):
+        """
+          :return: cached body or None
+        """
+        with self._lock:
+            body = self._pages.get(etag)
+            if body is None:
+                self.stats['misses'] += 1
+                return None
+            self._pages.move_to_end(etag)
+            self.stats['hits'] += 1
+            return body
+
+    def set(self, etag, body):
+        with self._lock:
+            self._pages[etag] = body
+            self._pages.move_to_end(etag)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+
+class FragmentCache:
+    """LRU cache of rendered template fragments."""
+    def __init__(self, max_entries=20000):
+        """
+          :param max_entries: fragments kept, least recently used are
+            dropped
+          :type max_entries: int
+        """
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0}
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, key, render):
+        """
+          :param key: identifies the fragment and the data it shows,
+            e.g. template, group and group version
+          :param render: builds the fragment on a miss
+          :type render: callable
+          :return: rendered fragment
+        """
+        with self._lock:
+            html = self._fragments.get(key)
+            if html is not None:
+                self._fragments.move_to_end(key)
+                self.stats['hits'] += 1
+                return html
+            self.stats['misses'] += 1
+        html = render()
+        with self._lock:
+            self._fragments[key] = html
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+        return html
+
+
+def make_cache(versions='memory', max_entries=2000, db=None):
+    """
+      Build the configured page cache.
+      :param versions: 'memory' or 'sqlite' (shared by workers)
+      :type versions: string
+      :param db: application database for 'sqlite'
+      :type db: tools.database.DataBase
+      :return: PageCache
+    """
+    if versions == 'sqlite':
+        store = SQLiteVersions(db)
+    elif versions == 'memory':
+        store = MemoryVersions()
+    else:
+        raise ValueError(f'Unknown page version store {versions}')
+    return PageCache(max_entries=max_entries, versions=store)
@@ -30,93 +30,545 @@
 .. moduleauthor:: AB <github.com/house-of-vanity>
 """
 
+import json
+import os
+import queue
 import sqlite3
 import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from tools.metrics import DISABLED
+from tools.migrations import (LATEST, check_rollups, migrate, rebuild_rollups,
+                              stored_version)
+from tools.queries import (QUERIES, existing_students, fts_any, fts_phrase,
+                           trigrams)
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
+# Pragmas applied to every new connection. journal_mode is persistent in the
+# database file, the rest are per-connection settings.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -8000,
+    'temp_store': 'MEMORY',
+}
+# Compiled statements kept per connection, enough for the whole registry.
+STATEMENT_CACHE_SIZE = 128
+# Seconds the writer waits for more concurrent jobs before committing a
+# batch, and the most jobs committed together. Jobs queued during a commit
+# are batched anyway; waiting only pays off when commits are expensive,
+# e.g. with synchronous = FULL.
+WRITE_DELAY = 0
+WRITE_BATCH = 256
+
+# Per-member outcomes reported by DataBase.add_group.
+INSERTED = 'inserted'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+MAX_NAME_LENGTH = 128
+# Rows looked up and inserted per statement during bulk ingestion.
+BATCH_SIZE = 500
+# Rows fetched at once by DataBase.stream.
+STREAM_CHUNK = 1000
+# Typo-tolerant search looks up this many trigrams of the query and
+# matches the FUZZY_TERMS least frequent of them.
+FUZZY_TERMS_CHECKED = 16
+FUZZY_TERMS = 4
+# Substring matches ranked per search, the first ones found.
+SEARCH_CANDIDATES = 200
+
+
+class ConnectionPool:
+    """Keeps a bounded set of open SQLite connections and hands them out
+    to callers. Idle connections are reused in LIFO order so the hot ones
+    keep their page and statement caches warm. Connections are never
+    shared between processes, a pool inherited by a forked worker drops
+    the parent's connections and opens its own."""
+    def __init__(self, basefile, size=8, pragmas=None):
+        """
+          :param basefile: SQLite database filename
+          :type basefile: string
+          :param size: max number of idle connections kept open
+          :type size: int
+          :param pragmas: overrides for DEFAULT_PRAGMAS
+          :type pragmas: dict
+        """
+        self.basefile = basefile
+        self.size = size
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.stats = {'opened': 0, 'reused': 0, 'closed': 0}
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def open(self):
+        """
+          Open and configure a new connection.
+          :return: sqlite3 connect object
+        """
+        log.debug("Open connection to %s", self.basefile)
+        conn = sqlite3.connect(
+            self.basefile,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        self._count('opened')
+        return conn
+
+    def acquire(self):
+        """
+          Take an idle connection or open a new one.
+          :return: sqlite3 connect object
+        """
+        if self._pid != os.getpid():
+            self._forked()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self.open()
+        self._count('reused')
+        return conn
+
+    def _forked(self):
+        # The parent keeps using its connections, closing them here could
+        # disturb its locks. Keep them referenced and start afresh.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            log.debug("Pool of %s inherited by worker %s",
+                      self.basefile, os.getpid())
+            self._inherited = self._idle
+            self._idle = queue.LifoQueue(maxsize=self.size)
+            self._pid = os.getpid()
+
+    def release(self, conn):
+        """
+          Return connection to the pool. Unfinished transactions are rolled
+          back, connections above the pool size are closed.
+          :param conn: sqlite3 connect object
+          :type conn: object
+          :return: None
+        """
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._close(conn)
+
+    def _close(self, conn):
+        log.debug("Close connection to %s", self.basefile)
+        conn.close()
+        self._count('closed')
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """
+          Close every idle connection.
+          :return: None
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
+
+
+class Writer:
+    """The only thread writing to the database. Jobs queued by any thread
+    are run on one dedicated connection and committed in groups: whatever
+    arrives within `delay` seconds of the first pending job shares a
+    single transaction, so concurrent writers neither wait on each other's
+    locks nor pay a commit each. A job arriving alone is committed right
+    away. Every job runs in its own savepoint, a
+    failing job is rolled back alone."""
+    def __init__(self, pool, delay=WRITE_DELAY, max_batch=WRITE_BATCH):
+        """
+          :param pool: pool opening the writer's connection
+          :type pool: ConnectionPool
+          :param delay: seconds to wait for more jobs, 0 commits whatever
+            is queued at once
+          :type delay: float
+          :param max_batch: most jobs per transaction
+          :type max_batch: int
+        """
+        self.pool = pool
+        self.delay = delay
+        self.max_batch = max_batch
+        self.stats = {'batches': 0, 'writes': 0, 'failed': 0}
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        # Started on first use, and again in a forked worker where the
+        # parent's thread does not exist.
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, args=(self._queue, self.pool.open()),
+                name='db-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, fn):
+        """
+          Queue a job.
+          :param fn: called with the writer's connection inside an open
+            transaction, must not commit or roll back itself
+          :type fn: callable
+          :return: Future of fn's result, set after the commit
+        """
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def _run(self, jobs, conn):
+        stop = False
+        while not stop:
+            job = jobs.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.max_batch:
+                # A lone job is committed at once. Once others are queued
+                # behind it writes are concurrent, wait a little for more.
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0 and len(batch) > 1:
+                        job = jobs.get(timeout=timeout)
+                    else:
+                        job = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        done = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute('SAVEPOINT job')
+                try:
+                    done.append((future, fn(conn), None))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    done.append((future, None, e))
+                conn.execute('RELEASE job')
+            conn.commit()
+        except Exception as e:
+            log.warning('Group commit of %s writes failed - %s', len(batch), e)
+            if conn.in_transaction:
+                conn.rollback()
+            done = [(future, None, e) for _, future in batch
+                    if not future.cancelled()]
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['writes'] += len(done)
+            self.stats['failed'] += sum(1 for _, _, e in done if e)
+        for future, result, error in done:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def close(self):
+        """
+          Commit queued jobs and stop the thread.
+          :return: None
+        """
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+
+@contextmanager
+def schema_lock(basefile):
+    """Hold an exclusive lock on `basefile`.lock, so worker processes
+    starting together set up the schema one at a time instead of racing
+    on the script and the migrations."""
+    if fcntl is None or basefile == ':memory:':
+        yield
+        return
+    with open(f'{basefile}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def roster_job(rosters, author):
+    """Writer job adding groups and their members, see DataBase.add_groups.
+    Names are checked before the job is queued, the job itself only looks
+    up existing students and inserts the rest in batches of BATCH_SIZE.
+    :returns: callable taking the writer's connection and returning the
+      outcomes by group name"""
+    outcomes = dict()
+    pending = dict()
+    for group_name, members in rosters.items():
+        outcomes[group_name] = []
+        for member in members:
+            name = member.strip()
+            if not name or len(name) > MAX_NAME_LENGTH:
+                outcomes[group_name].append([member, REJECTED])
+            elif name in pending:
+                outcomes[group_name].append([name, DUPLICATE])
+            else:
+                pending[name] = [name, INSERTED, group_name]
+                outcomes[group_name].append(pending[name])
+    def write(conn):
+        group_ids = dict()
+        for group_name in rosters:
+            conn.execute(QUERIES['add_group'], (group_name, author))
+            group_ids[group_name] = conn.execute(
+                QUERIES['group_id'], (group_name,)).fetchone()[0]
+        names = list(pending)
+        for i in range(0, len(names), BATCH_SIZE):
+            batch = names[i:i + BATCH_SIZE]
+            existing = conn.execute(
+                existing_students(len(batch)), batch).fetchall()
+            for (name,) in existing:
+                pending[name][1] = DUPLICATE
+            conn.executemany(
+                QUERIES['add_student'],
+                [(name, group_ids[pending[name][2]], author)
+                 for name in batch if pending[name][1] == INSERTED])
+        return {group_name: [tuple(outcome[:2]) for outcome in group_outcomes]
+                for group_name, group_outcomes in outcomes.items()}
+    return write
+
+
+def lesson_job(journal):
+    """Writer job storing a lesson and its marks, see DataBase.save_lesson.
+    :returns: callable taking the writer's connection and returning
+      (lesson ID, number of stored marks)"""
+    def write(conn):
+        lesson_id = journal.lesson_id
+        if lesson_id is None:
+            lesson_id = conn.execute(
+                QUERIES['start_lesson'],
+                (journal.group_id, journal.subject_id, journal.author)
+            ).lastrowid
+        # rowcount rather than total_changes, which adds rollup triggers.
+        marked = conn.executemany(
+            QUERIES['mark_student'], journal.rows(lesson_id)).rowcount
+        return lesson_id, marked
+    return write
+
 
 # class DataBase create or use existent SQLite database file. It provides 
 # high-level methods for database.
 class DataBase:
     """This class create or use existent SQLite database file. It provides 
     high-level methods for database."""
-    def __init__(self, scheme, basefile='data.sqlite'):
+    def __init__(self, scheme, basefile='data.sqlite', pool_size=8,
+                 pragmas=None, metrics=DISABLED, write_delay=WRITE_DELAY):
         """
           Constructor creates new SQLite database if 
           it doesn't exist. Uses SQL code from file for DB init.
+          A database already at the latest schema version is opened
+          without running the script or taking any lock.
           :param scheme: sql filename
           :type scheme: string
+          :param basefile: SQLite database filename
+          :type basefile: string
+          :param pool_size: max number of idle connections kept open
+          :type pool_size: int
+          :param pragmas: overrides for DEFAULT_PRAGMAS
+          :type pragmas: dict
+          :param metrics: registry for statement timings
+          :type metrics: tools.metrics.Metrics
+          :param write_delay: seconds the writer gathers jobs into one
+            commit
+          :type write_delay: float
           :return: None
         """
         self.scheme = ''
         self.basefile = basefile
+        self.metrics = metrics
+        self.pool = ConnectionPool(basefile, size=pool_size, pragmas=pragmas)
+        self.writer = Writer(self.pool, delay=write_delay)
         try:
-            conn = self.connect(basefile=basefile)
+            conn = self.pool.acquire()
         except:
             log.debug('Could not connect to DataBase.')
             return None
-        with open(scheme, 'r') as scheme_sql:
-            sql = scheme_sql.read()
-            self.scheme = sql
-            if conn is not None:
+        try:
+            if stored_version(conn) < LATEST:
+                self._init_schema(conn, scheme)
+        finally:
+            self.pool.release(conn)
+
+    def _init_schema(self, conn, scheme):
+        with schema_lock(self.basefile):
+            # Another worker may have finished while we waited for the lock.
+            if stored_version(conn) >= LATEST:
+                return
+            with open(scheme, 'r') as scheme_sql:
+                sql = scheme_sql.read()
+                self.scheme = sql
                 try:
                     cursor = conn.cursor()
                     cursor.executescript(sql)
                 except Exception as e:
                     log.debug(f'Could not create scheme - {e}')
-            else:
-                log.debug("Error! cannot create the database connection.")
-        log.info('DB created.')
-        self.close(conn)
+                    if conn.in_transaction:
+                        conn.rollback()
+            migrate(conn)
+            log.info('DB created.')
 
-    def connect(self, basefile):
+    def submit(self, fn, name=None):
         """
-          Create connect object for basefile
-          :param basefile: SQLite database filename
-          :type basefile: string
-          :return: sqlite3 connect object
+          Queue a write for the writer thread. `fn` is called with the
+          writer's connection inside the next group commit; when it raises,
+          only its own statements are rolled back.
+          :param fn: callable taking a sqlite3 connect object
+          :type fn: callable
+          :param name: label of the job in metrics, None when fn records
+            its own statements
+          :type name: string
+          :return: concurrent.futures.Future of fn's result, set once the
+            transaction is committed
         """
-        log.debug("Open connection to %s" % basefile)
-        return sqlite3.connect(basefile, check_same_thread=False)
+        if name is not None and self.metrics.enabled:
+            job = fn
+
+            def fn(conn):
+                started = time.perf_counter()
+                result = job(conn)
+                self._observe(name, started, 0)
+                return result
+        return self.writer.submit(fn)
 
-    def execute(self, sql):
+    def write(self, fn, name=None):
         """
-          Execute SQL code. First of all connect to self.basefile. Close 
-          connection after execution.
-          :param sql: SQL code
-          :type sql: string
+          Same as submit, waits for the commit.
+          :return: fn's result
+        """
+        return self.submit(fn, name).result()
+
+    def _observe(self, name, started, rows):
+        labels = (('query', name),)
+        self.metrics.observe(
+            'fesmoorique_query_seconds', labels, time.perf_counter() - started)
+        self.metrics.inc('fesmoorique_query_rows_total', labels, rows)
+
+    def _run(self, conn, name, params):
+        if not self.metrics.enabled:
+            return conn.execute(QUERIES[name], params).fetchall()
+        started = time.perf_counter()
+        rows = conn.execute(QUERIES[name], params).fetchall()
+        self._observe(name, started, len(rows))
+        return rows
+
+    def execute(self, name, params=()):
+        """
+          Execute modifying registry statement through the writer and wait
+          for the group commit it is part of.
+          :param name: statement name in QUERIES
+          :type name: string
+          :param params: values bound to statement placeholders
+          :type params: tuple
+          :return: list of response. Empty list when no rows are available.
+        """
+        log.debug("Executing: %s", name)
+        return self.write(lambda conn: self._run(conn, name, params))
+
+    def query(self, name, params=()):
+        """
+          Execute read-only registry statement on a pooled connection.
+          Nothing is committed.
+          :param name: statement name in QUERIES
+          :type name: string
+          :param params: values bound to statement placeholders
+          :type params: tuple
           :return: list of response. Empty list when no rows are available.
         """
-        conn = self.connect(basefile=self.basefile)
-        log.debug("Executing: %s" % sql)
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
-        result = cursor.fetchall()
-        self.close(conn)
-        return result
+        with self.pool.connection() as conn:
+            log.debug("Querying: %s", name)
+            return self._run(conn, name, params)
+
+    def stream(self, name, params=(), chunk_size=STREAM_CHUNK):
+        """
+          Iterate over results of a read-only registry statement in chunks
+          of `chunk_size` rows. The pooled connection is held until the
+          generator is exhausted or closed.
+          :param name: statement name in QUERIES
+          :type name: string
+          :param params: values bound to statement placeholders
+          :type params: tuple
+          :return: generator of lists of rows
+        """
+        started = time.perf_counter()
+        count = 0
+        with self.pool.connection() as conn:
+            log.debug("Streaming: %s", name)
+            cursor = conn.execute(QUERIES[name], params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    count += len(rows)
+                    yield rows
+            finally:
+                cursor.close()
+        if self.metrics.enabled:
+            self._observe(name, started, count)
 
     def get_subject(self, subject_id):
-        sql = f"SELECT * FROM subjects WHERE rowid = '{subject_id}'"
-        ret = self.execute(sql)
-        return ret
+        return self.query('get_subject', (subject_id,))
 
-    def get_group(self, group_id):
+    def get_group(self, group_id, after='', limit=-1):
         """
-          **Add new group and members**
+          **List group members ordered by name**
           :param group_id: ID of a group
           :type group_id: int
+          :param after: return members whose name sorts after this one
+          :type after: string
+          :param limit: page size, -1 for the whole group
+          :type limit: int
           :returns: list
         """
-        sql = """SELECT s.name, s.reg_date, g.name 
-        FROM `students` s LEFT JOIN `groups` g 
-        ON s.`group` = g.rowid WHERE g.rowid = '%s'""" % group_id
-        ret = self.execute(sql)
-        return ret
+        return self.query('get_group', (group_id, after, limit))
 
     def add_group(self, group_name, members, author):
         """
@@ -126,19 +578,132 @@ class DataBase:
           :param members: Group members
           :type members: list
           :param author: User who create group.
-          :type members: int
+          :type author: int
+
+          :returns: list of (member, outcome) in input order, outcome is
+            one of INSERTED, DUPLICATE or REJECTED.
+        """
+        return self.add_groups({group_name: members}, author)[group_name]
+
+    def add_groups(self, rosters, author):
+        """
+          **Add several groups and their members**
+          Everything is written in one transaction, students are looked up
+          and inserted in batches of BATCH_SIZE.
+          :param rosters: members by group name
+          :type rosters: dict
+          :param author: User who create groups.
+          :type author: int
+
+          :returns: dict of group name to list of (member, outcome) in input
+            order, outcome is one of INSERTED, DUPLICATE or REJECTED.
+        """
+        return self.write(roster_job(rosters, author), 'add_groups')
+
+    def save_lesson(self, journal):
+        """
+          **Write lesson and all of its attendance marks**
+          One transaction and one batched statement for the whole class.
+          :param journal: collected marks
+          :type journal: tools.attendance.LessonJournal
+
+          :returns: (lesson ID, number of stored marks). Rows the rollup
+            triggers update are not counted.
+        """
+        lesson_id, marked = self.write(lesson_job(journal), 'save_lesson')
+        journal.lesson_id = lesson_id
+        return lesson_id, marked
+
+    def sync(self, batch):
+        """
+          **Write queued operations of an offline client**
+          One transaction for the whole batch, operations already synced
+          under the same key are answered from their stored results.
+          :param batch: checked operations
+          :type batch: tools.sync.SyncBatch
+
+          :returns: list of per-operation results, see SyncBatch.apply
+        """
+        return self.write(batch.apply, 'sync')
+
+    def group_report(self, group_id):
+        """
+          **Attendance of a group from the rollup tables**
+          :param group_id: Group ID
+          :type group_id: int
+
+          :returns: (weeks, terms). weeks lists (subject, week, present,
+            total), terms lists (student, subject, term, present, total).
+        """
+        return (self.query('group_weeks', (group_id,)),
+                self.query('group_terms', (group_id,)))
+
+    def rebuild_rollups(self):
+        """
+          **Recompute attendance rollups from raw marks.**
+          Rollups are kept up to date by triggers, this is for backfills.
 
           :returns: None
         """
-        sql = f"INSERT OR IGNORE INTO groups('name', 'author')  VALUES ('{group_name}', {author})"
-        self.execute(sql)
-        sql = f"SELECT rowid FROM groups WHERE name = '{group_name}'"
-        ret = self.execute(sql)
-        group_id = ret[0][0]
-        for member in members:
-            sql = f'''INSERT OR IGNORE INTO students('name', 'group', 'author') 
-            VALUES ('{member}','{group_id}', '{author}')'''
-            self.execute(sql)
+        def write(conn):
+            for sql in rebuild_rollups():
+                conn.execute(sql)
+        self.write(write, 'rebuild_rollups')
+
+    def check_rollups(self):
+        """
+          **Compare attendance rollups with raw marks.**
+
+          :returns: dict of table name to number of differing rows, empty
+            when consistent.
+        """
+        with self.pool.connection() as conn:
+            return check_rollups(conn)
+
+    def find_group(self, group_name):
+        """
+          **Look up group ID by name**
+          :param group_name: Name of a group
+          :type group_name: string
+          :returns: int or None
+        """
+        ret = self.query('group_id', (group_name,))
+        return ret[0][0] if ret else None
+
+    def search_students(self, text, limit=20):
+        """
+          **Find students by name**
+          Names starting with `text` come first, then names containing it.
+          When nothing contains it, names sharing the rarest trigrams of
+          `text` are returned by relevance, which tolerates typos.
+          :param text: part of a name
+          :type text: string
+          :param limit: max number of results
+          :type limit: int
+
+          :returns: list of (student ID, name, group ID, group name)
+        """
+        text = ' '.join(text.split())
+        if not text:
+            return []
+        prefix = ' '.join(word.capitalize() for word in text.split(' '))
+        found = self.query(
+            'search_prefix', (prefix, prefix + '\U0010ffff', limit))
+        if len(found) < limit and len(text) >= 3:
+            seen = {row[0] for row in found}
+            found += [row for row in self.query(
+                'search_substring',
+                (fts_phrase(text), max(limit, SEARCH_CANDIDATES), limit))
+                if row[0] not in seen][:limit - len(found)]
+        if not found and len(text) > 3:
+            terms = trigrams(text)[:FUZZY_TERMS_CHECKED]
+            padded = terms + [None] * (FUZZY_TERMS_CHECKED - len(terms))
+            known = sorted((doc, term) for term, doc in self.query(
+                'trigram_frequency', padded))
+            rarest = [term for doc, term in known[:FUZZY_TERMS]]
+            if rarest:
+                found = self.query('search_fuzzy', (fts_any(rarest), limit))
+        return found
 
     def subject_list(self, user):
         """
@@ -148,41 +713,28 @@ class DataBase:
 
           :returns: list
         """
-        sql = f"""SELECT name, reg_date, rowid
-        FROM subjects
-        WHERE author = '{user}'"""
-        ret = self.execute(sql)
-        print(ret)
-        return ret
+        return self.query('subject_list', (user,))
 
-    def group_list(self, user='all', favourites=False):
+    def group_list(self, user='all', favourites=False, after='', limit=-1):
         """
-          **List user's groups or all groups.**
+          **List user's groups or all groups ordered by name.**
           :param user: User who create group.
           :type user: int
+          :param favourites: list all groups, flagging user's favourites
+          :type favourites: bool
+          :param after: return groups whose name sorts after this one
+          :type after: string
+          :param limit: page size, -1 for all groups
+          :type limit: int
 
           :returns: list
         """
-        if user != 'all':
-            sql = f"""SELECT g.name, g.reg_date, g.rowid, count(s.rowid) 
-            FROM `groups` g 
-            LEFT JOIN `students` s ON s.`group` = g.rowid 
-            WHERE g.author = {user} GROUP BY g.name"""
+        if favourites and user != 'all':
+            ret = self.query('group_list_favourites', (user, after, limit))
+        elif user != 'all':
+            ret = self.query('group_list_user', (user, after, limit))
         else:
-            sql = f"""SELECT g.name, g.reg_date, g.rowid, count(s.rowid), u.name 
-            FROM `groups` g 
-            LEFT JOIN `students` s ON s.`group` = g.rowid 
-            LEFT JOIN users u ON u.rowid = g.author 
-            GROUP BY g.name"""
-        if (favourites and str(user)):
-            sql = f"""SELECT g.name, g.reg_date, g.rowid, count(s.rowid), u.name, d.group_id
-            FROM `groups` g 
-            LEFT JOIN `students` s ON s.`group` = g.rowid 
-            LEFT JOIN users u ON u.rowid = g.author 
-            LEFT JOIN dashboard d ON d.group_id = g.rowid
-            GROUP BY g.name"""
-        ret = self.execute(sql)
-        print(ret)
+            ret = self.query('group_list_all', (after, limit))
         return ret
 
     def add_to_favourites(self, group_id, user_id):
@@ -195,8 +747,7 @@ class DataBase:
 
           :returns: None
         """
-        sql = f"INSERT OR IGNORE INTO dashboard(user_id, group_id) VALUES ('{user_id}', '{group_id}')"
-        self.execute(sql)
+        self.execute('add_to_favourites', (user_id, group_id))
 
     def remove_from_favourites(self, group_id, user_id):
         """
@@ -208,8 +759,7 @@ class DataBase:
 
           :returns: None
         """
-        sql = f"DELETE FROM dashboard WHERE user_id='{user_id}' and group_id='{group_id}'"
-        self.execute(sql)
+        self.execute('remove_from_favourites', (user_id, group_id))
 
     def get_dashboard(self, user):
         """
@@ -219,16 +769,17 @@ class DataBase:
 
           :returns: list
         """
-        sql = f"""SELECT g.name, g.reg_date, g.rowid, count(s.rowid) FROM dashboard d
-        LEFT JOIN users u ON u.rowid = d.user_id
-        LEFT JOIN `groups` g ON g.rowid = d.group_id
-        LEFT JOIN `students` s ON s.`group` = g.rowid
-        WHERE d.user_id = {user}
-        GROUP BY s.`group`
+        return self.query('get_dashboard', (user,))
+
+    def rebuild_member_counts(self):
         """
-        ret = self.execute(sql)
-        print(ret)
-        return ret
+          **Recount members of every group from students table.**
+          Counters are kept up to date by triggers, this is for repairs and
+          backfills.
+
+          :returns: None
+        """
+        self.execute('rebuild_member_counts')
 
     def user(self, action, name, pass_hash):
         """
@@ -238,32 +789,128 @@ class DataBase:
           :returns: None
         """
         if action == 'create':
-            sql = '''INSERT INTO users('name', 'pass')
-            VALUES ('%s', '%s')''' % (name, pass_hash)
-            self.execute(sql)
+            self.execute('create_user', (name, pass_hash))
 
     def login(self, name):
         """
           **Perform action with users table**
           :param action: Requested action
           :type action: string
-          :returns: None ?
+          :returns: (password hash, user ID, tenant ID) or False
         """
-        sql = "SELECT pass, rowid FROM users WHERE name = '%s'" % name
-        ret = self.execute(sql)
+        ret = self.query('login', (name,))
         if len(ret) == 0:
             ret = False
         else:
             ret = ret[0]
         return ret
 
-    def close(self, conn):
+    def set_password(self, user_id, pass_hash):
         """
-          Close connection object instance.
-          :param conn: sqlite3 connection object
-          :type conn: object
-          :return: None
+          **Replace stored password hash, used for rehash on login.**
+          :param user_id: User ID
+          :type user_id: int
+          :param pass_hash: new hash from tools.passwd
+          :type pass_hash: string
+          :returns: None
         """
-        log.debug("Close connection to %s" % self.basefile)
-        conn.close()
+        self.execute('set_password', (pass_hash, user_id))
+
+    def save_import(self, job_id, author, report):
+        """
+          **Store progress of a roster import.**
+          :param job_id: Import ID
+          :type job_id: string
+          :param author: User who imports
+          :type author: int
+          :param report: tools.roster.RosterImport.report() result
+          :type report: dict
+          :returns: None
+        """
+        self.execute('save_import', (job_id, author, report['state'],
+                                     json.dumps(report), time.time()))
+
+    def get_import(self, job_id, author):
+        """
+          **Look up progress of a roster import.**
+          :param job_id: Import ID
+          :type job_id: string
+          :param author: User who imports
+          :type author: int
+          :returns: report dict or None
+        """
+        ret = self.query('get_import', (job_id, author))
+        return json.loads(ret[0][0]) if ret else None
+
+    def prune_imports(self, before):
+        """
+          **Forget roster imports not updated since `before`.**
+          :param before: Unix time
+          :type before: float
+          :returns: None
+        """
+        self.execute('prune_imports', (before,))
+
+    def running_imports(self):
+        """
+          **Count roster imports that haven't ended.**
 
+          :returns: int
+        """
+        return self.query('running_imports')[0][0]
+
+    def tenant_list(self):
+        """
+          **List tenants of a directory database.**
+
+          :returns: list of (tenant ID, name, database file)
+        """
+        return self.query('tenant_list')
+
+    def add_tenant(self, name, basefile):
+        """
+          **Register a tenant in a directory database.**
+          :param name: Tenant name
+          :type name: string
+          :param basefile: SQLite file holding the tenant's data
+          :type basefile: string
+          :returns: tenant ID
+        """
+        return self.write(lambda conn: conn.execute(
+            QUERIES['add_tenant'], (name, basefile)).lastrowid)
+
+    def assign_tenant(self, user_name, tenant_name):
+        """
+          **Move a user of a directory database to a tenant.**
+          :param user_name: User name
+          :type user_name: string
+          :param tenant_name: Tenant name
+          :type tenant_name: string
+          :returns: (user ID, tenant ID), None when the user doesn't exist
+        """
+        def write(conn):
+            conn.execute(QUERIES['assign_tenant'], (tenant_name, user_name))
+            row = conn.execute(QUERIES['login'], (user_name,)).fetchone()
+            return row and row[1:]
+        return self.write(write)
+
+    def add_member_user(self, user_id, name):
+        """
+          **Copy a user into a tenant database.**
+          Passwords stay in the directory, the copy only lets tenant
+          queries show author names.
+          :param user_id: User ID in the directory
+          :type user_id: int
+          :param name: User name
+          :type name: string
+          :returns: None
+        """
+        self.execute('add_member_user', (name, user_id))
+
+    def close(self):
+        """
+          Finish queued writes and close all connections.
+          :return: None
+        """
+        self.writer.close()
+        self.pool.close_all()
@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: export
+   :synopsis: Streaming CSV and JSON encoders for table exports.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Encoders take an iterable of row chunks, as produced by DataBase.stream,
+and yield encoded text one chunk at a time, so memory use does not depend
+on the number of exported rows.
+"""
+
+import csv
+import io
+import json
+import zlib
+
+# Exportable tables: registry statement and column names.
+EXPORTS = {
+    'groups': ('export_groups',
+               ('id', 'name', 'reg_date', 'members', 'author')),
+    'students': ('export_students',
+                 ('id', 'name', 'reg_date', 'group')),
+    'attendance': ('export_attendance',
+                   ('lesson_id', 'started', 'group', 'subject', 'student',
+                    'present')),
+}
+
+
+def csv_chunks(columns, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def json_chunks(columns, chunks):
+    """Encode rows as a JSON array of objects."""
+    separator = '[\n'
+    for rows in chunks:
+        encoded = ',\n'.join(
+            json.dumps(dict(zip(columns, row)), ensure_ascii=False)
+            for row in rows)
+        if encoded:
+            yield separator + encoded
+            separator = ',\n'
+    yield '[]\n' if separator == '[\n' else '\n]\n'
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
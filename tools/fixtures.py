@@ -0,0 +1,86 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: fixtures
+   :synopsis: Opt-in loader of demo and test rows.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+data.sql only creates the schema. The sample users, groups, subjects and
+students live in fixtures.sql and are loaded on request into a migrated
+database. Rows that already exist are left alone, so loading twice is
+harmless.
+
+    $ python -m tools.fixtures data.sqlite
+    $ python -m tools.fixtures data.sqlite my_fixtures.sql
+"""
+
+import argparse
+import logging
+import os
+import sqlite3
+
+from tools.database import DataBase
+
+HOME_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SCHEME = os.path.join(HOME_DIR, 'data.sql')
+FIXTURES = os.path.join(HOME_DIR, 'fixtures.sql')
+
+
+def load_fixtures(conn, path=FIXTURES):
+    """
+      Run a fixture script against a migrated database.
+      :param conn: sqlite3 connect object in autocommit mode
+      :type conn: object
+      :param path: SQL file of INSERT OR IGNORE statements
+      :type path: string
+      :return: None
+    """
+    with open(path, 'r') as f:
+        script = f.read()
+    try:
+        conn.executescript(script)
+    except:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load fesmoorique fixtures.')
+    parser.add_argument('basefile', nargs='?', default='data.sqlite')
+    parser.add_argument('fixtures', nargs='?', default=FIXTURES)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    DataBase(scheme=SCHEME, basefile=args.basefile).close()
+    conn = sqlite3.connect(args.basefile, isolation_level=None)
+    load_fixtures(conn, args.fixtures)
+    print(f'Loaded {args.fixtures}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
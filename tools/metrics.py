@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: metrics
+   :synopsis: Latency histograms and counters in Prometheus text format.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Callers check ``metrics.enabled`` before timing anything, so a disabled
+registry costs one attribute lookup per request or query.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds in seconds of histogram buckets.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+HELP = {
+    'fesmoorique_request_seconds': 'Latency of authorized views.',
+    'fesmoorique_query_seconds': 'Latency of registry statements.',
+    'fesmoorique_query_rows_total': 'Rows returned by registry statements.',
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Metrics:
+    """Registry of labelled histograms and counters."""
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        """
+          :param enabled: record anything at all
+          :type enabled: bool
+          :param buckets: histogram bucket upper bounds, in seconds
+          :type buckets: tuple
+        """
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = dict()
+        self._counters = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, metric, labels, value):
+        """
+          Add `value` to a histogram.
+          :param metric: metric name
+          :type metric: string
+          :param labels: label names and values
+          :type labels: tuple of pairs
+        """
+        key = (metric, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, metric, labels, amount=1):
+        key = (metric, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render(self, gauges=()):
+        """
+          :param gauges: extra (metric, labels, value) samples, e.g. pool
+            statistics kept elsewhere
+          :return: Prometheus text exposition of all metrics
+        """
+        lines = []
+        typed = set()
+
+        def header(metric, kind):
+            if metric not in typed:
+                typed.add(metric)
+                if metric in HELP:
+                    lines.append(f'# HELP {metric} {HELP[metric]}')
+                lines.append(f'# TYPE {metric} {kind}')
+
+        with self._lock:
+            histograms = sorted(
+                (key, list(h.counts), h.sum)
+                for key, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+        for (metric, labels), counts, total in histograms:
+            header(metric, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket = _labels(labels + (('le', bound),))
+                lines.append(f'{metric}_bucket{bucket} {cumulative}')
+            lines.append(f'{metric}_sum{_labels(labels)} {total}')
+            lines.append(f'{metric}_count{_labels(labels)} {cumulative}')
+        for (metric, labels), value in counters:
+            header(metric, 'counter')
+            lines.append(f'{metric}{_labels(labels)} {value}')
+        for metric, labels, value in gauges:
+            header(metric, 'gauge')
+            lines.append(f'{metric}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Shared disabled registry, default for components built without metrics.
+DISABLED = Metrics(enabled=False)
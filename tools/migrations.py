@@ -0,0 +1,434 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: migrations
+   :synopsis: Versioned schema migrations and query plan checks.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Migrations are applied in order on top of the tables created by data.sql.
+Applied versions are recorded in the ``schema_version`` table, each
+migration runs in its own transaction.
+
+    $ python -m tools.migrations data.sqlite          # apply pending
+    $ python -m tools.migrations data.sqlite --check  # verify query plans
+    $ python -m tools.migrations data.sqlite --rebuild-counts
+    $ python -m tools.migrations data.sqlite --rebuild-rollups
+    $ python -m tools.migrations data.sqlite --check-rollups
+"""
+
+import argparse
+import logging
+import sqlite3
+import sys
+
+from tools.queries import QUERIES, ROLLUPS, TERM, WEEK, rollup_mismatches
+
+log = logging.getLogger(__name__)
+
+
+def rebuild(table, columns, select):
+    """Statements recreating `table` with new column definitions while
+    keeping its rows. The old rowid is kept in the explicit id column."""
+    return [
+        f'CREATE TABLE "{table}_new" ({columns})',
+        f'INSERT INTO "{table}_new" {select}',
+        f'DROP TABLE "{table}"',
+        f'ALTER TABLE "{table}_new" RENAME TO "{table}"',
+    ]
+
+
+def rollup_triggers():
+    """Triggers adding every attendance mark to the rollup tables."""
+    statements = []
+    for event, row, present, total in (
+            ('INSERT', 'NEW', 'NEW.present', 1),
+            ('DELETE', 'OLD', '-OLD.present', -1),
+            ('UPDATE OF present', 'NEW', 'NEW.present - OLD.present', 0)):
+        name = event.split()[0].lower()
+        statements.append(f'''CREATE TRIGGER attendance_rollup_{name}
+        AFTER {event} ON attendance
+        BEGIN
+            INSERT INTO attendance_lessons(lesson_id, present, total)
+            VALUES ({row}.lesson_id, {present}, {total})
+            ON CONFLICT(lesson_id) DO UPDATE SET
+                present = present + excluded.present,
+                total = total + excluded.total;
+            INSERT INTO attendance_weeks(group_id, subject_id, week, present, total)
+            SELECT l.group_id, l.subject_id, {WEEK}, {present}, {total}
+            FROM lessons l WHERE l.id = {row}.lesson_id
+            ON CONFLICT(group_id, subject_id, week) DO UPDATE SET
+                present = present + excluded.present,
+                total = total + excluded.total;
+            INSERT INTO attendance_terms(student_id, subject_id, term, present, total)
+            SELECT {row}.student_id, l.subject_id, {TERM}, {present}, {total}
+            FROM lessons l WHERE l.id = {row}.lesson_id
+            ON CONFLICT(student_id, subject_id, term) DO UPDATE SET
+                present = present + excluded.present,
+                total = total + excluded.total;
+        END''')
+    return statements
+
+
+def rebuild_rollups():
+    """Statements recomputing every rollup table from raw marks."""
+    statements = []
+    for table, aggregate in ROLLUPS.items():
+        statements.append(f'DELETE FROM {table}')
+        statements.append(f'INSERT INTO {table} {aggregate}')
+    return statements
+
+
+# (version, description, statements). Append only, never edit applied ones.
+MIGRATIONS = [
+    (1, 'explicit integer keys', [
+        *rebuild('users', '''
+            "name" TEXT NOT NULL UNIQUE,
+            "pass" TEXT NOT NULL,
+            "reg_date" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "id" INTEGER PRIMARY KEY''',
+            'SELECT name, pass, reg_date, rowid FROM users'),
+        *rebuild('groups', '''
+            "name" TEXT NOT NULL UNIQUE,
+            "reg_date" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "author" INT NOT NULL,
+            "id" INTEGER PRIMARY KEY''',
+            'SELECT name, reg_date, author, rowid FROM groups'),
+        *rebuild('subjects', '''
+            "name" TEXT NOT NULL UNIQUE,
+            "reg_date" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "author" INT NOT NULL,
+            "id" INTEGER PRIMARY KEY''',
+            'SELECT name, reg_date, author, rowid FROM subjects'),
+        *rebuild('students', '''
+            "name" TEXT NOT NULL UNIQUE,
+            "group" INTEGER NOT NULL,
+            "reg_date" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "author" INT NOT NULL,
+            "id" INTEGER PRIMARY KEY''',
+            'SELECT name, CAST("group" AS INTEGER), reg_date, author, rowid '
+            'FROM students'),
+    ]),
+    (2, 'indexes for dashboard and group listings', [
+        '''DELETE FROM dashboard WHERE rowid NOT IN (
+            SELECT min(rowid) FROM dashboard GROUP BY user_id, group_id)''',
+        'CREATE UNIQUE INDEX dashboard_user_group ON dashboard(user_id, group_id)',
+        'CREATE INDEX students_group ON students("group", name, reg_date)',
+        'CREATE INDEX groups_author ON groups(author, name)',
+        'CREATE INDEX subjects_author ON subjects(author)',
+    ]),
+    (3, 'maintained group member counts', [
+        'ALTER TABLE groups ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0',
+        QUERIES['rebuild_member_counts'],
+        '''CREATE TRIGGER students_count_insert AFTER INSERT ON students
+        BEGIN
+            UPDATE groups SET member_count = member_count + 1
+            WHERE id = NEW."group";
+        END''',
+        '''CREATE TRIGGER students_count_delete AFTER DELETE ON students
+        BEGIN
+            UPDATE groups SET member_count = member_count - 1
+            WHERE id = OLD."group";
+        END''',
+        '''CREATE TRIGGER students_count_move AFTER UPDATE OF "group" ON students
+        WHEN OLD."group" IS NOT NEW."group"
+        BEGIN
+            UPDATE groups SET member_count = member_count - 1
+            WHERE id = OLD."group";
+            UPDATE groups SET member_count = member_count + 1
+            WHERE id = NEW."group";
+        END''',
+    ]),
+    (4, 'lessons and attendance', [
+        '''CREATE TABLE lessons (
+            "group_id" INTEGER NOT NULL,
+            "subject_id" INTEGER NOT NULL,
+            "author" INT NOT NULL,
+            "started" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "id" INTEGER PRIMARY KEY)''',
+        'CREATE INDEX lessons_group ON lessons(group_id, subject_id, started)',
+        '''CREATE TABLE attendance (
+            "lesson_id" INTEGER NOT NULL,
+            "student_id" INTEGER NOT NULL,
+            "present" INTEGER NOT NULL,
+            "marked" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY("lesson_id", "student_id")) WITHOUT ROWID''',
+    ]),
+    (5, 'attendance rollups', [
+        '''CREATE TABLE attendance_lessons (
+            "lesson_id" INTEGER PRIMARY KEY,
+            "present" INTEGER NOT NULL,
+            "total" INTEGER NOT NULL)''',
+        '''CREATE TABLE attendance_weeks (
+            "group_id" INTEGER NOT NULL,
+            "subject_id" INTEGER NOT NULL,
+            "week" TEXT NOT NULL,
+            "present" INTEGER NOT NULL,
+            "total" INTEGER NOT NULL,
+            PRIMARY KEY("group_id", "subject_id", "week")) WITHOUT ROWID''',
+        '''CREATE TABLE attendance_terms (
+            "student_id" INTEGER NOT NULL,
+            "subject_id" INTEGER NOT NULL,
+            "term" TEXT NOT NULL,
+            "present" INTEGER NOT NULL,
+            "total" INTEGER NOT NULL,
+            PRIMARY KEY("student_id", "subject_id", "term")) WITHOUT ROWID''',
+        *rollup_triggers(),
+        *rebuild_rollups(),
+    ]),
+    (6, 'student name search index', [
+        '''CREATE VIRTUAL TABLE students_fts USING fts5(
+            name, content='students', content_rowid='id', tokenize='trigram')''',
+        '''CREATE TRIGGER students_fts_insert AFTER INSERT ON students
+        BEGIN
+            INSERT INTO students_fts(rowid, name) VALUES (NEW.id, NEW.name);
+        END''',
+        '''CREATE TRIGGER students_fts_delete AFTER DELETE ON students
+        BEGIN
+            INSERT INTO students_fts(students_fts, rowid, name)
+            VALUES ('delete', OLD.id, OLD.name);
+        END''',
+        '''CREATE TRIGGER students_fts_update AFTER UPDATE OF name ON students
+        BEGIN
+            INSERT INTO students_fts(students_fts, rowid, name)
+            VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO students_fts(rowid, name) VALUES (NEW.id, NEW.name);
+        END''',
+        "INSERT INTO students_fts(students_fts) VALUES ('rebuild')",
+        "CREATE VIRTUAL TABLE students_fts_vocab USING fts5vocab(students_fts, 'row')",
+    ]),
+    (7, 'page cache versions shared by workers', [
+        '''CREATE TABLE page_versions (
+            "tag" TEXT PRIMARY KEY,
+            "version" INTEGER NOT NULL) WITHOUT ROWID''',
+    ]),
+    # Only used in the directory database, tenant shards get empty ones.
+    (8, 'tenant directory', [
+        '''CREATE TABLE tenants (
+            "name" TEXT NOT NULL UNIQUE,
+            "basefile" TEXT NOT NULL,
+            "id" INTEGER PRIMARY KEY)''',
+        'ALTER TABLE users ADD COLUMN tenant_id INTEGER',
+    ]),
+    (9, 'idempotency keys of synced operations', [
+        '''CREATE TABLE sync_ops (
+            "user_id" INTEGER NOT NULL,
+            "key" TEXT NOT NULL,
+            "result" TEXT NOT NULL,
+            "applied" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY("user_id", "key")) WITHOUT ROWID''',
+        'CREATE INDEX sync_ops_applied ON sync_ops(applied)',
+    ]),
+    (10, 'roster import progress shared by workers', [
+        '''CREATE TABLE roster_imports (
+            "id" TEXT PRIMARY KEY,
+            "author" INT NOT NULL,
+            "state" TEXT NOT NULL,
+            "report" TEXT NOT NULL,
+            "updated" REAL NOT NULL) WITHOUT ROWID''',
+        'CREATE INDEX roster_imports_updated ON roster_imports(updated)',
+        'CREATE INDEX roster_imports_state ON roster_imports(state)',
+    ]),
+]
+
+# Version of a fully migrated database.
+LATEST = MIGRATIONS[-1][0]
+
+# Statements whose plans must use index lookups. Values are the aliases
+# allowed to be scanned because the statement lists the whole table anyway.
+PLAN_CHECKS = {
+    'login': (),
+    'get_group': (),
+    'get_dashboard': (),
+    'subject_list': (),
+    'group_list_user': (),
+    'group_list_all': ('g',),
+    'group_list_all_from': ('g',),
+    'group_list_favourites': ('g',),
+    'group_weeks': (),
+    'group_terms': (),
+    'search_prefix': (),
+    'sync_result': (),
+    'lesson_group': (),
+    'prune_sync_ops': (),
+    'get_import': (),
+    'prune_imports': (),
+    'running_imports': (),
+}
+
+
+def current_version(conn):
+    """
+      :param conn: sqlite3 connect object
+      :type conn: object
+      :return: latest applied migration version, 0 for a fresh database.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        "version" INTEGER PRIMARY KEY,
+        "name" TEXT NOT NULL,
+        "applied" DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)''')
+    return conn.execute(
+        'SELECT coalesce(max(version), 0) FROM schema_version').fetchone()[0]
+
+
+def stored_version(conn):
+    """
+      Read-only variant of current_version, takes no write lock.
+      :param conn: sqlite3 connect object
+      :type conn: object
+      :return: latest applied migration version, 0 for a fresh database.
+    """
+    try:
+        return conn.execute(
+            'SELECT coalesce(max(version), 0) FROM schema_version').fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """
+      Apply pending migrations in order. Connection must be in autocommit
+      mode (isolation_level=None).
+      :param conn: sqlite3 connect object
+      :type conn: object
+      :return: list of applied versions
+    """
+    applied = []
+    for version, name, statements in migrations:
+        if version <= current_version(conn):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another process may have migrated while we waited for the lock.
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            for sql in statements:
+                conn.execute(sql)
+            conn.execute(
+                'INSERT INTO schema_version(version, name) VALUES (?, ?)',
+                (version, name))
+        except:
+            conn.rollback()
+            raise
+        conn.commit()
+        log.info(f'Applied migration {version} - {name}')
+        applied.append(version)
+    return applied
+
+
+def full_scans(conn, name, allowed=()):
+    """
+      Run EXPLAIN QUERY PLAN for a registry statement.
+      :param name: statement name in QUERIES
+      :type name: string
+      :param allowed: table aliases which may be scanned
+      :type allowed: tuple
+      :return: list of plan steps scanning a table without an index
+    """
+    sql = QUERIES[name]
+    params = (None,) * sql.count('?')
+    scans = []
+    for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+        detail = row[-1]
+        if not detail.startswith('SCAN ') or ' USING ' in detail:
+            continue
+        if detail.split()[1] in allowed:
+            continue
+        scans.append(detail)
+    return scans
+
+
+def check_plans(conn, checks=PLAN_CHECKS):
+    """
+      :param conn: sqlite3 connect object
+      :type conn: object
+      :return: dict of statement name to offending plan steps, empty when
+        every checked statement uses index lookups.
+    """
+    failures = dict()
+    for name, allowed in checks.items():
+        scans = full_scans(conn, name, allowed)
+        if scans:
+            failures[name] = scans
+    return failures
+
+
+def check_rollups(conn):
+    """
+      :param conn: sqlite3 connect object
+      :type conn: object
+      :return: dict of rollup table to number of rows differing from the
+        raw attendance marks, empty when all rollups are consistent.
+    """
+    failures = dict()
+    for table in ROLLUPS:
+        mismatches = conn.execute(rollup_mismatches(table)).fetchone()[0]
+        if mismatches:
+            failures[table] = mismatches
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate fesmoorique database.')
+    parser.add_argument('basefile', nargs='?', default='data.sqlite')
+    parser.add_argument('--check', action='store_true',
+                        help='verify hot queries use index lookups')
+    parser.add_argument('--rebuild-counts', action='store_true',
+                        help='recount group members from students')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='recompute attendance rollups from marks')
+    parser.add_argument('--check-rollups', action='store_true',
+                        help='compare attendance rollups with marks')
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.basefile, isolation_level=None)
+    if args.rebuild_counts or args.rebuild_rollups:
+        migrate(conn)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if args.rebuild_counts:
+                conn.execute(QUERIES['rebuild_member_counts'])
+            if args.rebuild_rollups:
+                for sql in rebuild_rollups():
+                    conn.execute(sql)
+        print('Rebuilt')
+        return
+    if args.check_rollups:
+        failures = check_rollups(conn)
+        for table, mismatches in failures.items():
+            print(f'{table}: {mismatches} rows differ from attendance')
+        sys.exit(1 if failures else 0)
+    if args.check:
+        failures = check_plans(conn)
+        for name, scans in failures.items():
+            print(f'{name}: {"; ".join(scans)}')
+        sys.exit(1 if failures else 0)
+    applied = migrate(conn)
+    print(f'Schema version {current_version(conn)}, applied {applied}')
+
+
+if __name__ == '__main__':
+    main()
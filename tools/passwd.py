@@ -25,27 +25,109 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-import hashlib, binascii, os
+import hashlib, binascii, os, threading, time
+from concurrent.futures import ProcessPoolExecutor
 
-def hash_password(password):
+# PBKDF2 work factor for new hashes. Stored hashes record their own factor,
+# hashes without a prefix predate that and used LEGACY_ITERATIONS.
+ITERATIONS = 100000
+LEGACY_ITERATIONS = 100000
+PREFIX = 'pbkdf2_sha512'
+
+
+class KdfBusy(Exception):
+    """Raised when too many password checks are already queued."""
+
+
+def _pbkdf2(password, salt, iterations):
+    pwdhash = hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'),
+                                  salt, iterations)
+    return binascii.hexlify(pwdhash).decode('ascii')
+
+def _split(stored_password):
+    """Return (iterations, salt, hash) of a stored password."""
+    if stored_password.startswith(PREFIX + '$'):
+        _, iterations, stored_password = stored_password.split('$', 2)
+        iterations = int(iterations)
+    else:
+        iterations = LEGACY_ITERATIONS
+    return iterations, stored_password[:64], stored_password[64:]
+
+def hash_password(password, iterations=ITERATIONS):
     """hash a password for storing."""
     salt = hashlib.sha256(os.urandom(60)).hexdigest().encode('ascii')
-    pwdhash = hashlib.pbkdf2_hmac('sha512', password.encode('utf-8'), 
-                                salt, 100000)
-    pwdhash = binascii.hexlify(pwdhash)
-    return (salt + pwdhash).decode('ascii')
+    pwdhash = _pbkdf2(password, salt, iterations)
+    return f"{PREFIX}${iterations}${salt.decode('ascii')}{pwdhash}"
 
 def verify_password(stored_password, provided_password):
     """Verify a stored password against one provided by user"""
-    salt = stored_password[:64]
-    stored_password = stored_password[64:]
-    pwdhash = hashlib.pbkdf2_hmac('sha512', 
-                                  provided_password.encode('utf-8'), 
-                                  salt.encode('ascii'), 
-                                  100000)
-    pwdhash = binascii.hexlify(pwdhash).decode('ascii')
+    iterations, salt, stored_password = _split(stored_password)
+    pwdhash = _pbkdf2(provided_password, salt.encode('ascii'), iterations)
     return pwdhash == stored_password
 
+def needs_rehash(stored_password, iterations=ITERATIONS):
+    """Whether stored password uses another work factor or format."""
+    return not stored_password.startswith(f"{PREFIX}${iterations}$")
+
+def check_password(stored_password, provided_password, iterations=ITERATIONS):
+    """Verify a password and rehash it when the work factor changed.
+    Runs in KdfPool worker processes.
+    :returns: (valid, new hash or None, seconds spent in KDF)"""
+    started = time.perf_counter()
+    valid = verify_password(stored_password, provided_password)
+    new_hash = None
+    if valid and needs_rehash(stored_password, iterations):
+        new_hash = hash_password(provided_password, iterations)
+    return valid, new_hash, time.perf_counter() - started
+
+
+class KdfPool:
+    """Runs password checks in a process pool so they neither hold the GIL
+    nor block request threads. At most `max_pending` checks are queued or
+    running, further ones fail fast with KdfBusy."""
+    def __init__(self, workers=2, max_pending=16, iterations=ITERATIONS):
+        """
+          :param workers: worker processes
+          :type workers: int
+          :param max_pending: checks allowed to queue or run at once
+          :type max_pending: int
+          :param iterations: work factor for new and rehashed passwords
+          :type iterations: int
+        """
+        self.iterations = iterations
+        # Verified when the user does not exist, at the factor real hashes
+        # are upgraded to, so every login attempt costs the same single
+        # KDF run.
+        self.dummy_hash = f'{PREFIX}${iterations}$' + '0' * 192
+        self.stats = {'checks': 0, 'rejected': 0, 'kdf_seconds': 0.0}
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def check(self, stored_password, provided_password):
+        """
+          Verify password in a worker process.
+          :return: (valid, new hash to store or None)
+          :raises KdfBusy: when the queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise KdfBusy()
+        try:
+            valid, new_hash, seconds = self._executor.submit(
+                check_password, stored_password, provided_password,
+                self.iterations).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self.stats['checks'] += 1
+            self.stats['kdf_seconds'] += seconds
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown()
+
 def rand_hash():
     """hash a password for storing."""
     salt = hashlib.sha256(os.urandom(60)).hexdigest().encode('ascii')
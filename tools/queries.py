@@ -0,0 +1,276 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: queries
+   :synopsis: Named, parameter-bound SQL statements used by DataBase.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Every statement is a constant string, so sqlite3 compiles it once per
+connection and reuses it from the connection's statement cache. Values are
+always bound with ``?`` placeholders, never formatted into the SQL text.
+"""
+
+QUERIES = {
+    'get_subject': """SELECT * FROM subjects WHERE rowid = ?""",
+
+    # Listings are paged by key: rows after the given name, in name order.
+    'get_group': """SELECT s.name, s.reg_date, g.name, s.id
+        FROM `students` s JOIN `groups` g
+        ON s.`group` = g.rowid WHERE s.`group` = ? AND s.name > ?
+        ORDER BY s.name LIMIT ?""",
+
+    'add_group': """INSERT OR IGNORE INTO groups('name', 'author')
+        VALUES (?, ?)""",
+
+    'group_id': """SELECT rowid FROM groups WHERE name = ?""",
+
+    'add_student': """INSERT OR IGNORE INTO students('name', 'group', 'author')
+        VALUES (?, ?, ?)""",
+
+    'subject_list': """SELECT name, reg_date, rowid
+        FROM subjects
+        WHERE author = ?""",
+
+    'group_list_user': """SELECT g.name, g.reg_date, g.rowid, g.member_count
+        FROM `groups` g
+        WHERE g.author = ? AND g.name > ?
+        ORDER BY g.name LIMIT ?""",
+
+    'group_list_all': """SELECT g.name, g.reg_date, g.rowid, g.member_count, u.name
+        FROM `groups` g
+        LEFT JOIN users u ON u.rowid = g.author
+        WHERE g.name > ?
+        ORDER BY g.name LIMIT ?""",
+
+    'group_list_all_from': """SELECT g.name, g.reg_date, g.rowid, g.member_count, u.name
+        FROM `groups` g
+        LEFT JOIN users u ON u.rowid = g.author
+        WHERE g.name >= ?
+        ORDER BY g.name LIMIT ?""",
+
+    'group_list_favourites': """SELECT g.name, g.reg_date, g.rowid, g.member_count, u.name, d.group_id
+        FROM `groups` g
+        LEFT JOIN users u ON u.rowid = g.author
+        LEFT JOIN dashboard d ON d.group_id = g.rowid AND d.user_id = ?
+        WHERE g.name > ?
+        ORDER BY g.name LIMIT ?""",
+
+    'add_to_favourites': """INSERT OR IGNORE INTO dashboard(user_id, group_id)
+        VALUES (?, ?)""",
+
+    'remove_from_favourites': """DELETE FROM dashboard
+        WHERE user_id = ? AND group_id = ?""",
+
+    'get_dashboard': """SELECT g.name, g.reg_date, g.rowid, g.member_count FROM dashboard d
+        JOIN `groups` g ON g.rowid = d.group_id
+        WHERE d.user_id = ?
+        ORDER BY g.name""",
+
+    'rebuild_member_counts': """UPDATE `groups` SET member_count = (
+        SELECT count(*) FROM `students` s WHERE s.`group` = `groups`.id)""",
+
+    'start_lesson': """INSERT INTO lessons(group_id, subject_id, author)
+        VALUES (?, ?, ?)""",
+
+    # Students outside of the lesson's group are silently skipped. Upsert
+    # rather than REPLACE, so rollup triggers see the update.
+    'mark_student': """INSERT INTO attendance(lesson_id, present, student_id)
+        SELECT ?, ?, id FROM students WHERE id = ? AND `group` = ?
+        ON CONFLICT(lesson_id, student_id) DO UPDATE
+        SET present = excluded.present, marked = CURRENT_TIMESTAMP""",
+
+    'group_weeks': """SELECT sub.name, w.week, w.present, w.total
+        FROM attendance_weeks w
+        JOIN subjects sub ON sub.id = w.subject_id
+        WHERE w.group_id = ? AND w.total > 0
+        ORDER BY w.week, sub.name""",
+
+    'group_terms': """SELECT s.name, sub.name, t.term, t.present, t.total
+        FROM students s
+        JOIN attendance_terms t ON t.student_id = s.id
+        JOIN subjects sub ON sub.id = t.subject_id
+        WHERE s.`group` = ? AND t.total > 0
+        ORDER BY s.name, sub.name, t.term""",
+
+    # Exports walk whole tables in key order.
+    'export_groups': """SELECT g.id, g.name, g.reg_date, g.member_count, u.name
+        FROM `groups` g LEFT JOIN users u ON u.rowid = g.author
+        ORDER BY g.id""",
+
+    'export_students': """SELECT s.id, s.name, s.reg_date, g.name
+        FROM `students` s JOIN `groups` g ON g.id = s.`group`
+        ORDER BY s.id""",
+
+    'export_group_students': """SELECT s.id, s.name, s.reg_date, g.name
+        FROM `students` s JOIN `groups` g ON g.id = s.`group`
+        WHERE s.`group` = ?
+        ORDER BY s.name""",
+
+    'export_attendance': """SELECT a.lesson_id, l.started, g.name, sub.name, s.name, a.present
+        FROM attendance a
+        JOIN lessons l ON l.id = a.lesson_id
+        JOIN `groups` g ON g.id = l.group_id
+        JOIN subjects sub ON sub.id = l.subject_id
+        JOIN `students` s ON s.id = a.student_id
+        ORDER BY a.lesson_id, s.name""",
+
+    # Student search: name prefixes through the name index, substrings and
+    # typo-tolerant matches through the trigram index.
+    # Substring matches are ranked shortest name first, which is what FTS
+    # rank gives for a single phrase, but only among the first candidates
+    # found: rank itself reads every match to weigh the phrase.
+    'search_substring': """SELECT s.id, s.name, g.id, g.name
+        FROM (SELECT rowid FROM students_fts
+              WHERE students_fts MATCH ? LIMIT ?) f
+        JOIN `students` s ON s.id = f.rowid
+        JOIN `groups` g ON g.id = s.`group`
+        ORDER BY length(s.name), s.name LIMIT ?""",
+
+    'search_fuzzy': """SELECT s.id, s.name, g.id, g.name
+        FROM students_fts f
+        JOIN `students` s ON s.id = f.rowid
+        JOIN `groups` g ON g.id = s.`group`
+        WHERE students_fts MATCH ?
+        ORDER BY f.rank LIMIT ?""",
+
+    'trigram_frequency': """SELECT term, doc FROM students_fts_vocab
+        WHERE term IN (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+
+    'search_prefix': """SELECT s.id, s.name, g.id, g.name
+        FROM `students` s
+        JOIN `groups` g ON g.id = s.`group`
+        WHERE s.name >= ? AND s.name < ?
+        ORDER BY s.name LIMIT ?""",
+
+    'create_user': """INSERT INTO users('name', 'pass') VALUES (?, ?)""",
+
+    'login': """SELECT pass, rowid, tenant_id FROM users WHERE name = ?""",
+
+    'set_password': """UPDATE users SET pass = ? WHERE rowid = ?""",
+
+    'tenant_list': """SELECT id, name, basefile FROM tenants ORDER BY name""",
+
+    'add_tenant': """INSERT INTO tenants(name, basefile) VALUES (?, ?)""",
+
+    'assign_tenant': """UPDATE users
+        SET tenant_id = (SELECT id FROM tenants WHERE name = ?)
+        WHERE name = ?""",
+
+    'add_member_user': """INSERT INTO users(name, pass, id) VALUES (?, '', ?)
+        ON CONFLICT(id) DO UPDATE SET name = excluded.name""",
+
+    'bump_page_version': """INSERT INTO page_versions(tag, version)
+        VALUES (?, 1)
+        ON CONFLICT(tag) DO UPDATE SET version = version + 1""",
+
+    'lesson_group': """SELECT group_id, subject_id FROM lessons WHERE id = ?""",
+
+    # Results of synced operations by the client's idempotency key.
+    'sync_result': """SELECT result FROM sync_ops
+        WHERE user_id = ? AND key = ?""",
+
+    'save_sync_result': """INSERT INTO sync_ops(user_id, key, result)
+        VALUES (?, ?, ?)""",
+
+    'prune_sync_ops': """DELETE FROM sync_ops
+        WHERE applied < datetime('now', ?)""",
+
+    # Roster import progress, written by the worker running the import and
+    # read by whichever worker gets the poll.
+    'save_import': """INSERT INTO roster_imports(id, author, state, report, updated)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(id) DO UPDATE SET state = excluded.state,
+            report = excluded.report, updated = excluded.updated""",
+
+    'get_import': """SELECT report FROM roster_imports
+        WHERE id = ? AND author = ?""",
+
+    'prune_imports': """DELETE FROM roster_imports WHERE updated < ?""",
+
+    'running_imports': """SELECT count(*) FROM roster_imports
+        WHERE state IN ('pending', 'running')""",
+}
+
+# Rollup grouping of a lesson `l`: calendar week and half-year term.
+WEEK = "strftime('%Y-%W', l.started)"
+TERM = ("strftime('%Y', l.started) || "
+        "CASE WHEN strftime('%m', l.started) <= '06' THEN '-1' ELSE '-2' END")
+
+# Attendance rollup tables and the aggregate over raw marks each of them
+# must be equal to. Used to rebuild and check the rollups.
+ROLLUPS = {
+    'attendance_lessons': """SELECT a.lesson_id, sum(a.present), count(*)
+        FROM attendance a GROUP BY 1""",
+    'attendance_weeks': f"""SELECT l.group_id, l.subject_id, {WEEK},
+        sum(a.present), count(*)
+        FROM attendance a JOIN lessons l ON l.id = a.lesson_id
+        GROUP BY 1, 2, 3""",
+    'attendance_terms': f"""SELECT a.student_id, l.subject_id, {TERM},
+        sum(a.present), count(*)
+        FROM attendance a JOIN lessons l ON l.id = a.lesson_id
+        GROUP BY 1, 2, 3""",
+}
+
+
+def rollup_mismatches(table):
+    """Statement counting rows of a rollup table differing from its
+    aggregate over raw marks, in either direction."""
+    rows = f"SELECT * FROM {table} WHERE total > 0"
+    return f"""SELECT count(*) FROM (
+        SELECT * FROM ({rows} EXCEPT {ROLLUPS[table]})
+        UNION ALL
+        SELECT * FROM ({ROLLUPS[table]} EXCEPT {rows}))"""
+
+
+def fts_phrase(text):
+    """MATCH expression for names containing `text`."""
+    return '"%s"' % text.replace('"', '""')
+
+
+def trigrams(text):
+    """Lowercased trigrams of `text` as stored in the search index."""
+    text = text.lower()
+    return sorted({text[i:i + 3] for i in range(len(text) - 2)})
+
+
+def fts_any(terms):
+    """MATCH expression for names containing any of `terms`."""
+    return ' OR '.join(fts_phrase(term) for term in terms)
+
+
+def existing_students(count):
+    """Statement looking up which of `count` student names already exist.
+    Bulk ingestion always asks for full batches except the last one, so
+    only a couple of distinct texts end up in the statement cache."""
+    marks = ', '.join('?' * count)
+    return f"SELECT name FROM students WHERE name IN ({marks})"
+
+
+def page_versions(count):
+    """Statement reading the versions of `count` page cache tags."""
+    marks = ', '.join('?' * count)
+    return f"SELECT tag, version FROM page_versions WHERE tag IN ({marks})"
@@ -0,0 +1,177 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: roster
+   :synopsis: Roster import from CSV files.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Files have a group and a student name per row, an optional header row is
+skipped. They are read row by row and written through
+DataBase.add_groups one batch at a time, so the whole file is never held in
+memory and progress can be watched while the import runs.
+"""
+
+import csv
+import logging
+import os
+import threading
+import time
+
+from tools.database import INSERTED, DUPLICATE, REJECTED
+
+log = logging.getLogger(__name__)
+
+# Rows written per transaction.
+IMPORT_BATCH = 5000
+# Rejected rows kept for the report.
+MAX_REPORTED = 100
+
+
+def normalize_name(raw):
+    """Collapse whitespace and capitalize every word of a name."""
+    return ' '.join(word.capitalize() for word in raw.split())
+
+
+class RosterImport:
+    """Import of one uploaded CSV file, run in a background thread. Its
+    report is stored in the database when it starts, after every batch
+    and when it ends, so any worker process can answer progress polls."""
+    def __init__(self, db, path, author, job_id, batch_size=IMPORT_BATCH,
+                 on_batch=None):
+        """
+          :param db: database to write to
+          :type db: tools.database.DataBase
+          :param path: CSV file, removed when the import ends
+          :type path: string
+          :param author: User who imports
+          :type author: int
+          :param job_id: ID the report is stored under
+          :type job_id: string
+          :param batch_size: rows per transaction
+          :type batch_size: int
+          :param on_batch: called with the group names of every written
+            batch
+          :type on_batch: callable
+        """
+        self.db = db
+        self.path = path
+        self.author = author
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.state = 'pending'
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.size = os.path.getsize(path)
+        self.position = 0
+        self.rows = 0
+        self.groups = set()
+        self.summary = {INSERTED: 0, DUPLICATE: 0, REJECTED: 0}
+        self.rejected = []
+
+    def start(self):
+        self._save()
+        thread = threading.Thread(target=self.run, name='roster-import',
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        self.state = 'running'
+        self.started = time.time()
+        try:
+            with open(self.path, newline='', encoding='utf-8-sig') as f:
+                batch = dict()
+                count = 0
+                for row in csv.reader(f):
+                    self.position = f.buffer.tell()
+                    if self.rows == 0 and self._is_header(row):
+                        continue
+                    self.rows += 1
+                    if len(row) < 2 or not row[0].strip():
+                        self._reject(row)
+                        continue
+                    group = row[0].strip().upper()
+                    batch.setdefault(group, []).append(normalize_name(row[1]))
+                    count += 1
+                    if count >= self.batch_size:
+                        self._write(batch)
+                        batch, count = dict(), 0
+                if batch:
+                    self._write(batch)
+            self.position = self.size
+            self.state = 'done'
+        except Exception as e:
+            log.warning(f'Roster import of {self.path} failed - {e}')
+            self.state = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished = time.time()
+            os.remove(self.path)
+            self._save()
+
+    def _save(self):
+        try:
+            self.db.save_import(self.job_id, self.author, self.report())
+        except Exception as e:
+            log.warning(f'Saving progress of import {self.job_id} failed - {e}')
+
+    @staticmethod
+    def _is_header(row):
+        return [c.strip().lower() for c in row[:2]] == ['group', 'name']
+
+    def _reject(self, row):
+        self.summary[REJECTED] += 1
+        if len(self.rejected) < MAX_REPORTED:
+            self.rejected.append(','.join(row))
+
+    def _write(self, batch):
+        outcomes = self.db.add_groups(batch, self.author)
+        for group, group_outcomes in outcomes.items():
+            for name, outcome in group_outcomes:
+                self.summary[outcome] += 1
+                if outcome == REJECTED and len(self.rejected) < MAX_REPORTED:
+                    self.rejected.append(f'{group},{name}')
+        self.groups.update(batch)
+        if self.on_batch:
+            self.on_batch(list(batch))
+        self._save()
+
+    def report(self):
+        """Progress and summary of the import as a dict."""
+        elapsed = (self.finished or time.time()) - (self.started or time.time())
+        return {
+            'state': self.state,
+            'error': self.error,
+            'progress': round(self.position / self.size, 3) if self.size else 1,
+            'rows': self.rows,
+            'groups': len(self.groups),
+            'summary': self.summary,
+            'rejected': self.rejected,
+            'seconds': round(elapsed, 2),
+        }
@@ -0,0 +1,226 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: seed
+   :synopsis: Synthetic dataset generator for benchmarks.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Creates (or extends) a database through DataBase, so data.sql and the
+migrations are applied, then bulk-inserts users, groups, subjects, students,
+dashboard favourites and optionally lessons with attendance marks. Triggers
+on the seeded tables are dropped for the load and recreated afterwards,
+member counts, rollups and the search index are then rebuilt in one go.
+Every user gets the same password so benchmarks can log in as any of them.
+
+    $ python -m tools.seed bench.sqlite --students 200000
+"""
+
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import time
+
+from tools.database import DataBase
+from tools.migrations import rebuild_rollups
+from tools.passwd import hash_password
+from tools.queries import QUERIES
+
+log = logging.getLogger(__name__)
+
+# Tables whose triggers are suspended during the load.
+SEEDED = ('students', 'attendance')
+# Rows per executemany call.
+CHUNK = 10000
+
+FIRST_NAMES = (
+    'Ivan', 'Petr', 'Anna', 'Maria', 'Olga', 'Sergey', 'Dmitry', 'Elena',
+    'Nikolay', 'Tatiana', 'Alexey', 'Irina', 'Pavel', 'Natalia', 'Andrey',
+    'Svetlana', 'Mikhail', 'Ekaterina', 'Yuri', 'Daria')
+LAST_NAMES = (
+    'Ivanov', 'Petrov', 'Sidorov', 'Smirnov', 'Kuznetsov', 'Popov', 'Volkov',
+    'Sokolov', 'Lebedev', 'Kozlov', 'Novikov', 'Morozov', 'Egorov', 'Orlov',
+    'Pavlov', 'Semenov', 'Golubev', 'Vinogradov', 'Bogdanov', 'Fedorov')
+
+
+def chunked(rows, size=CHUNK):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(conn, sql, rows):
+    """executemany over a generator in CHUNK sized batches."""
+    count = 0
+    for batch in chunked(rows):
+        conn.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def next_id(conn, table):
+    return conn.execute(
+        f'SELECT coalesce(max(id), 0) + 1 FROM "{table}"').fetchone()[0]
+
+
+def seed(conn, users=100, groups=1000, subjects=50, students=30000,
+         favourites=5, lessons=0, password='bench', prefix='seed', rng=None):
+    """
+      Insert a synthetic dataset in one transaction. Connection must be in
+      autocommit mode and the schema fully migrated.
+      :param users: number of users, named {prefix}0, {prefix}1, ...
+      :type users: int
+      :param favourites: groups on every user's dashboard
+      :type favourites: int
+      :param lessons: lessons to record, every member of the lesson's
+        group gets a mark
+      :type lessons: int
+      :param password: password of every seeded user
+      :type password: string
+      :param prefix: prefix of generated names, run again with another
+        prefix to grow an existing database
+      :type prefix: string
+      :return: dict of table to inserted rows
+    """
+    rng = rng or random.Random()
+    pass_hash = hash_password(password)
+    counts = dict()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        triggers = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' "
+            f"AND tbl_name IN ({','.join('?' * len(SEEDED))})",
+            SEEDED).fetchall()
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER "{name}"')
+
+        first_user = next_id(conn, 'users')
+        counts['users'] = insert(
+            conn, 'INSERT INTO users(name, pass) VALUES (?, ?)',
+            ((f'{prefix}{i}', pass_hash) for i in range(users)))
+        user_ids = range(first_user, first_user + users)
+
+        first_group = next_id(conn, 'groups')
+        counts['groups'] = insert(
+            conn, 'INSERT INTO groups(name, author) VALUES (?, ?)',
+            ((f'{prefix.upper()}{i:05d}', rng.choice(user_ids))
+             for i in range(groups)))
+        group_ids = range(first_group, first_group + groups)
+
+        counts['subjects'] = insert(
+            conn, 'INSERT INTO subjects(name, author) VALUES (?, ?)',
+            ((f'Subject {prefix} {i}', user_ids[i % users])
+             for i in range(subjects)))
+
+        first_student = next_id(conn, 'students')
+        members = dict()
+        for i in range(students):
+            members.setdefault(rng.choice(group_ids), []).append(
+                first_student + i)
+        counts['students'] = insert(
+            conn, 'INSERT INTO students(name, "group", author) VALUES (?, ?, ?)',
+            ((f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {prefix}{i}',
+              group_id, rng.choice(user_ids))
+             for group_id, ids in members.items() for i in ids))
+
+        counts['dashboard'] = insert(
+            conn, 'INSERT OR IGNORE INTO dashboard(user_id, group_id) VALUES (?, ?)',
+            ((user_id, group_id) for user_id in user_ids
+             for group_id in rng.sample(group_ids, min(favourites, groups))))
+
+        subject_ids = [row[0] for row in conn.execute('SELECT id FROM subjects')]
+        first_lesson = next_id(conn, 'lessons')
+        taught = [rng.choice(list(members)) for _ in range(lessons)]
+        counts['lessons'] = insert(
+            conn,
+            "INSERT INTO lessons(group_id, subject_id, author, started) "
+            "VALUES (?, ?, ?, datetime('now', ?))",
+            ((group_id, rng.choice(subject_ids), rng.choice(user_ids),
+              f'-{rng.randrange(365 * 24)} hours')
+             for group_id in taught))
+        counts['attendance'] = insert(
+            conn,
+            'INSERT INTO attendance(lesson_id, student_id, present) VALUES (?, ?, ?)',
+            ((first_lesson + n, student_id, int(rng.random() < 0.8))
+             for n, group_id in enumerate(taught)
+             for student_id in members[group_id]))
+
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.execute(QUERIES['rebuild_member_counts'])
+        conn.execute("INSERT INTO students_fts(students_fts) VALUES ('rebuild')")
+        for sql in rebuild_rollups():
+            conn.execute(sql)
+    except:
+        conn.rollback()
+        raise
+    conn.commit()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fill a fesmoorique database with synthetic rows.')
+    parser.add_argument('basefile', nargs='?', default='bench.sqlite')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--subjects', type=int, default=50)
+    parser.add_argument('--students', type=int, default=30000)
+    parser.add_argument('--favourites', type=int, default=5,
+                        help='dashboard groups per user')
+    parser.add_argument('--lessons', type=int, default=0)
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--prefix', default='seed',
+                        help='prefix of generated names')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed for a reproducible dataset')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    scheme = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))), 'data.sql')
+    DataBase(scheme=scheme, basefile=args.basefile).close()
+    conn = sqlite3.connect(args.basefile, isolation_level=None)
+    started = time.perf_counter()
+    counts = seed(
+        conn, args.users, args.groups, args.subjects, args.students,
+        args.favourites, args.lessons, args.password, args.prefix,
+        random.Random(args.seed))
+    conn.close()
+    elapsed = time.perf_counter() - started
+    print(', '.join(f'{count} {table}' for table, count in counts.items()),
+          f'in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: sessions
+   :synopsis: Expiring session stores used for login cookies.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+MemorySessionStore keeps sessions in the process and is enough for a single
+worker. SQLiteSessionStore keeps them in a database file shared by every
+worker process. Both expire sessions after `ttl` seconds of inactivity.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from tools.database import ConnectionPool
+
+log = logging.getLogger(__name__)
+
+# Idle seconds after which a session expires.
+DEFAULT_TTL = 12 * 60 * 60
+
+
+class MemorySessionStore:
+    """In-process LRU session store with expiry."""
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=10000):
+        """
+          :param ttl: idle seconds after which a session expires
+          :type ttl: int
+          :param max_entries: least recently used sessions above this
+            number are dropped
+          :type max_entries: int
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.closed = threading.Event()
+
+    def get(self, token):
+        """
+          :param token: session cookie value
+          :type token: string
+          :return: session data dict or None when missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < now:
+                del self._sessions[token]
+                return None
+            self._sessions[token] = (now + self.ttl, data)
+            self._sessions.move_to_end(token)
+            return data
+
+    def set(self, token, data):
+        with self._lock:
+            self._sessions[token] = (time.time() + self.ttl, data)
+            self._sessions.move_to_end(token)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def evict(self):
+        """
+          Drop expired sessions.
+          :return: number of dropped sessions
+        """
+        now = time.time()
+        with self._lock:
+            expired = [t for t, (expires, _) in self._sessions.items()
+                       if expires < now]
+            for token in expired:
+                del self._sessions[token]
+        return len(expired)
+
+    def close(self):
+        self.closed.set()
+
+
+class SQLiteSessionStore:
+    """Session store in a SQLite file, shared between worker processes.
+    Expiry is only pushed forward once half of the ttl has passed, so most
+    requests cost a single indexed read."""
+    def __init__(self, basefile, ttl=DEFAULT_TTL, pool_size=4):
+        """
+          :param basefile: SQLite database filename
+          :type basefile: string
+          :param ttl: idle seconds after which a session expires
+          :type ttl: int
+          :param pool_size: max number of idle connections kept open
+          :type pool_size: int
+        """
+        self.ttl = ttl
+        self.pool = ConnectionPool(basefile, size=pool_size)
+        self.closed = threading.Event()
+        with self.pool.connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                "token" TEXT PRIMARY KEY,
+                "data" TEXT NOT NULL,
+                "expires" REAL NOT NULL) WITHOUT ROWID''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS sessions_expires
+                ON sessions(expires)''')
+
+    def get(self, token):
+        now = time.time()
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                'SELECT data, expires FROM sessions WHERE token = ?',
+                (token,)).fetchone()
+            if row is None:
+                return None
+            data, expires = row
+            if expires < now:
+                conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
+                return None
+            if expires - now < self.ttl / 2:
+                conn.execute(
+                    'UPDATE sessions SET expires = ? WHERE token = ?',
+                    (now + self.ttl, token))
+        return json.loads(data)
+
+    def set(self, token, data):
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions(token, data, expires) '
+                'VALUES (?, ?, ?)',
+                (token, json.dumps(data), time.time() + self.ttl))
+
+    def delete(self, token):
+        with self.pool.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
+
+    def evict(self):
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
+                'DELETE FROM sessions WHERE expires < ?', (time.time(),))
+            return cursor.rowcount
+
+    def close(self):
+        self.closed.set()
+        self.pool.close_all()
+
+
+def start_reaper(store, interval=60):
+    """
+      Evict expired sessions from `store` every `interval` seconds in a
+      daemon thread, until the store is closed.
+      :return: threading.Thread
+    """
+    def reap():
+        while not store.closed.wait(interval):
+            try:
+                evicted = store.evict()
+            except Exception as e:
+                log.warning(f'Session eviction failed - {e}')
+                continue
+            if evicted:
+                log.debug(f'Evicted {evicted} expired sessions')
+    thread = threading.Thread(target=reap, name='session-reaper', daemon=True)
+    thread.start()
+    return thread
+
+
+def make_store(backend='memory', basefile='sessions.sqlite', ttl=DEFAULT_TTL,
+               reap_interval=60):
+    """
+      Build the configured session store and start its reaper.
+      :param backend: 'memory' or 'sqlite'
+      :type backend: string
+      :return: session store
+    """
+    if backend == 'sqlite':
+        store = SQLiteSessionStore(basefile, ttl=ttl)
+    elif backend == 'memory':
+        store = MemorySessionStore(ttl=ttl)
+    else:
+        raise ValueError(f'Unknown session backend {backend}')
+    if reap_interval:
+        start_reaper(store, reap_interval)
+    return store
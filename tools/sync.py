@@ -0,0 +1,219 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: sync
+   :synopsis: Batched, idempotent writes of offline clients.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+Clients queue operations while offline and send them in one request. Every
+operation carries a key chosen by the client. Its result is stored under
+that key in the same transaction as its writes, so a batch sent again
+after a lost response answers with the stored results instead of writing
+twice.
+"""
+
+import json
+
+from tools.attendance import LessonJournal
+from tools.database import lesson_job, roster_job
+from tools.queries import QUERIES
+from tools.roster import normalize_name
+
+# Most operations in one request, and the longest key.
+MAX_OPS = 1000
+MAX_KEY_LENGTH = 128
+# Days a key is remembered. Retries older than that are applied again.
+KEEP_DAYS = 30
+
+# Per-operation status reported by SyncBatch.apply.
+APPLIED = 'applied'
+REPLAYED = 'replayed'
+FAILED = 'failed'
+
+
+def read_marks(marks):
+    """Marks of a JSON object of student ID to presence."""
+    if not isinstance(marks, dict):
+        raise ValueError('marks must map student IDs to true or false')
+    return {int(student_id): bool(present)
+            for student_id, present in marks.items()}
+
+
+class SyncBatch:
+    """Operations of one sync request by one user. They are checked when
+    the batch is built and written by DataBase.sync in a single
+    transaction, each in its own savepoint, so a failing operation is
+    reported alone and doesn't undo the others.
+
+    Operations are JSON objects with a `key` and an `op`:
+
+    - `lesson`: new lesson of `group_id` and `subject_id` with `marks`,
+      an object of student ID to presence
+    - `marks`: more `marks` for `lesson`, a lesson ID or the key of an
+      earlier `lesson` operation
+    - `favourite`: add `group_id` to favourites, or remove it when
+      `favourite` is false
+    - `members`: add `members`, a list of names, to the `group` name
+    """
+    def __init__(self, ops, user_id, keep_days=KEEP_DAYS):
+        """
+          :param ops: operations in the order they were made
+          :type ops: list
+          :param user_id: User who made them, keys are per user
+          :type user_id: int
+          :param keep_days: age of keys forgotten on apply
+          :type keep_days: int
+          :raises ValueError: ops is not a list or too long
+        """
+        if not isinstance(ops, list):
+            raise ValueError('ops must be a list')
+        if len(ops) > MAX_OPS:
+            raise ValueError(f'At most {MAX_OPS} ops per request')
+        self.user_id = user_id
+        self.keep_days = keep_days
+        # Page cache tags of the data written, for the caller to bump.
+        self.tags = set()
+        self.ops = [self._read(op) for op in ops]
+
+    def _read(self, op):
+        """(key, write, error), write is None when the op is malformed."""
+        key = op.get('key') if isinstance(op, dict) else None
+        if not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH:
+            return key, None, (
+                f'key must be a string of 1 to {MAX_KEY_LENGTH} characters')
+        name = op.get('op')
+        read = self.OPS.get(name) if isinstance(name, str) else None
+        if read is None:
+            return key, None, f'unknown op {name!r}'
+        try:
+            return key, read(self, op), None
+        except KeyError as e:
+            return key, None, f'missing {e}'
+        except (ArithmeticError, TypeError, ValueError) as e:
+            return key, None, str(e)
+
+    def _lesson(self, op):
+        journal = LessonJournal(op['group_id'], op['subject_id'], self.user_id)
+        journal.marks = read_marks(op['marks'])
+        def write(conn):
+            lesson_id, marked = lesson_job(journal)(conn)
+            return {'lesson_id': lesson_id, 'marked': marked}
+        return write
+
+    def _marks(self, op):
+        lesson, marks = op['lesson'], read_marks(op['marks'])
+        if not isinstance(lesson, (int, str)):
+            raise ValueError('lesson must be a lesson ID or an op key')
+        def write(conn):
+            lesson_id = lesson
+            if isinstance(lesson, str):
+                stored = self._stored(conn, lesson)
+                if stored is None or 'lesson_id' not in stored:
+                    raise LookupError(f'no lesson synced as {lesson!r}')
+                lesson_id = stored['lesson_id']
+            row = conn.execute(
+                QUERIES['lesson_group'], (lesson_id,)).fetchone()
+            if row is None:
+                raise LookupError(f'no lesson {lesson_id}')
+            journal = LessonJournal(*row, self.user_id, lesson_id)
+            journal.marks = marks
+            lesson_id, marked = lesson_job(journal)(conn)
+            return {'lesson_id': lesson_id, 'marked': marked}
+        return write
+
+    def _favourite(self, op):
+        group_id = int(op['group_id'])
+        name = ('add_to_favourites' if op.get('favourite', True)
+                else 'remove_from_favourites')
+        def write(conn):
+            conn.execute(QUERIES[name], (self.user_id, group_id))
+            self.tags.add(f'dashboard:{self.user_id}')
+            return {}
+        return write
+
+    def _members(self, op):
+        if not isinstance(op['group'], str) or not op['group'].strip():
+            raise ValueError('group must be a group name')
+        group_name = op['group'].strip().upper()
+        if not isinstance(op['members'], list) or not all(
+                isinstance(m, str) for m in op['members']):
+            raise ValueError('members must be a list of names')
+        members = [normalize_name(m) for m in op['members']]
+        job = roster_job({group_name: [m for m in members if m]},
+                         self.user_id)
+        def write(conn):
+            outcomes = job(conn)[group_name]
+            group_id = conn.execute(
+                QUERIES['group_id'], (group_name,)).fetchone()[0]
+            self.tags.update(('groups', f'group:{group_id}'))
+            return {'group_id': group_id,
+                    'outcomes': [list(outcome) for outcome in outcomes]}
+        return write
+
+    OPS = {
+        'lesson': _lesson,
+        'marks': _marks,
+        'favourite': _favourite,
+        'members': _members,
+    }
+
+    def _stored(self, conn, key):
+        row = conn.execute(
+            QUERIES['sync_result'], (self.user_id, key)).fetchone()
+        return row and json.loads(row[0])
+
+    def apply(self, conn):
+        """
+          Writer job of the batch, see DataBase.sync. Operations whose key
+          is already stored are not written again.
+          :param conn: the writer's connection
+          :return: list of results in op order, dicts with the `key`, a
+            `status` of APPLIED, REPLAYED or FAILED and either the op's
+            result or an `error`
+        """
+        conn.execute(QUERIES['prune_sync_ops'], (f'-{self.keep_days} days',))
+        results = []
+        for key, write, error in self.ops:
+            if write is None:
+                results.append({'key': key, 'status': FAILED, 'error': error})
+                continue
+            stored = self._stored(conn, key)
+            if stored is not None:
+                results.append(dict(stored, key=key, status=REPLAYED))
+                continue
+            conn.execute('SAVEPOINT op')
+            try:
+                result = write(conn)
+                conn.execute(QUERIES['save_sync_result'],
+                             (self.user_id, key, json.dumps(result)))
+            except Exception as e:
+                conn.execute('ROLLBACK TO op')
+                results.append({'key': key, 'status': FAILED, 'error': str(e)})
+            else:
+                results.append(dict(result, key=key, status=APPLIED))
+            conn.execute('RELEASE op')
+        return results
@@ -0,0 +1,238 @@
+#
+# Copyright (c) 2019, UltraDesu <ultradesu@hexor.ru>
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#     names of its contributors may be used to endorse or promote products
+#     derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY UltraDesu <ultradesu@hexor.ru> ''AS IS'' AND ANY
+# EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL UltraDesu <ultradesu@hexor.ru> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+"""
+.. module:: tenants
+   :synopsis: Routing of users to per-institution database files.
+.. moduleauthor:: AB <github.com/house-of-vanity>
+
+The directory database (FESMOORIQUE_DB) holds the users and the list of
+tenants. Each tenant keeps its groups, students, subjects, dashboards and
+attendance in a database file of its own, with its own connection pool
+and writer, so tenants never wait on each other's writes. Users without
+a tenant keep their data in the directory database itself, which is all a
+single-institution setup ever uses.
+
+    $ python -m tools.tenants data.sqlite add physics physics.sqlite
+    $ python -m tools.tenants data.sqlite assign admin1 physics
+    $ python -m tools.tenants data.sqlite list
+"""
+
+import argparse
+import heapq
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.database import DataBase
+
+log = logging.getLogger(__name__)
+
+HOME_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# Name of the tenant whose data lives in the directory database.
+DEFAULT_TENANT = 'default'
+# Threads running one query on every tenant at once.
+FAN_OUT_WORKERS = 8
+
+
+class Shards:
+    """Directory database and lazily opened tenant databases."""
+    def __init__(self, directory, open_shard, workers=FAN_OUT_WORKERS):
+        """
+          :param directory: database with users and tenants
+          :type directory: tools.database.DataBase
+          :param open_shard: builds the DataBase of a tenant from its file
+          :type open_shard: callable
+          :param workers: threads of fan-out queries
+          :type workers: int
+        """
+        self.directory = directory
+        self.open_shard = open_shard
+        self.workers = workers
+        self._shards = dict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _basefile(self, basefile):
+        # Relative tenant files live next to the directory database.
+        return os.path.join(
+            os.path.dirname(os.path.abspath(self.directory.basefile)), basefile)
+
+    def get(self, tenant_id):
+        """
+          :param tenant_id: tenant of the user, None for the default tenant
+          :return: DataBase holding the tenant's data
+          :raises KeyError: for an unknown tenant
+        """
+        if tenant_id is None:
+            return self.directory
+        shard = self._shards.get(tenant_id)
+        if shard is not None:
+            return shard
+        with self._lock:
+            if tenant_id not in self._shards:
+                files = {i: basefile for i, _, basefile
+                         in self.directory.tenant_list()}
+                log.info('Opening tenant %s database', tenant_id)
+                self._shards[tenant_id] = self.open_shard(
+                    self._basefile(files[tenant_id]))
+            return self._shards[tenant_id]
+
+    def add_tenant(self, name, basefile):
+        """
+          Register a tenant and create its database.
+          :param name: Tenant name, DEFAULT_TENANT is taken by the
+            directory database
+          :type name: string
+          :param basefile: SQLite file of the tenant's data, relative to
+            the directory database
+          :type basefile: string
+          :return: tenant ID
+          :raises ValueError: for the reserved name
+        """
+        if name == DEFAULT_TENANT:
+            raise ValueError(f'{DEFAULT_TENANT} names the directory database')
+        tenant_id = self.directory.add_tenant(name, basefile)
+        self.get(tenant_id)
+        return tenant_id
+
+    def tenants(self):
+        """
+          :return: list of (tenant name, DataBase), the default tenant
+            first
+        """
+        return [(DEFAULT_TENANT, self.directory)] + [
+            (name, self.get(tenant_id))
+            for tenant_id, name, _ in self.directory.tenant_list()]
+
+    def fan_out(self, fn):
+        """
+          Call fn(db) for every tenant in parallel.
+          :param fn: callable taking a DataBase
+          :return: list of (tenant name, result) in tenants() order
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.workers, thread_name_prefix='fan-out')
+        tenants = self.tenants()
+        futures = [self._executor.submit(fn, db) for _, db in tenants]
+        return [(name, future.result())
+                for (name, _), future in zip(tenants, futures)]
+
+    def group_list(self, after='', after_tenant='', limit=100):
+        """
+          **List groups of all tenants ordered by name and tenant.**
+          :param after: name of the last group of the previous page
+          :type after: string
+          :param after_tenant: tenant of the last group of the previous page
+          :type after_tenant: string
+          :param limit: page size
+          :type limit: int
+
+          :returns: (rows, cursor). rows are (tenant, name, reg_date, id,
+            members, author), cursor is the (after, after_tenant) of the
+            next page or None on the last one.
+        """
+        def page(db):
+            # One more row than needed, `after` itself may be skipped.
+            return db.query('group_list_all_from', (after, limit + 2))
+
+        def rows(tenant, groups):
+            for row in groups:
+                # Tenants up to after_tenant already listed their `after`.
+                if row[0] == after and (not after_tenant or tenant <= after_tenant):
+                    continue
+                yield (row[0], tenant) + tuple(row[1:])
+        merged = heapq.merge(*(rows(tenant, groups) for tenant, groups
+                               in self.fan_out(page)))
+        result = []
+        for row in merged:
+            result.append((row[1], row[0]) + row[2:])
+            if len(result) > limit:
+                last = result[limit - 1]
+                return result[:limit], (last[1], last[0])
+        return result, None
+
+    def close(self):
+        """
+          Close every tenant database, not the directory.
+          :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+        for shard in self._shards.values():
+            shard.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage fesmoorique tenants.')
+    parser.add_argument('basefile', help='directory database')
+    sub = parser.add_subparsers(dest='command', required=True)
+    add = sub.add_parser('add', help='register a tenant and create its database')
+    add.add_argument('name')
+    add.add_argument('tenant_basefile')
+    assign = sub.add_parser('assign', help='move a user to a tenant')
+    assign.add_argument('user')
+    assign.add_argument('tenant')
+    sub.add_parser('list', help='list tenants')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    scheme = os.path.join(HOME_DIR, 'data.sql')
+    directory = DataBase(scheme=scheme, basefile=args.basefile)
+    shards = Shards(directory, lambda basefile: DataBase(scheme=scheme,
+                                                         basefile=basefile))
+    try:
+        if args.command == 'add':
+            try:
+                tenant_id = shards.add_tenant(args.name, args.tenant_basefile)
+            except ValueError as e:
+                parser.error(str(e))
+            print(f'Tenant {args.name} is {tenant_id}')
+        elif args.command == 'assign':
+            tenant_ids = {name: i for i, name, _ in directory.tenant_list()}
+            if args.tenant not in tenant_ids:
+                parser.error(f'unknown tenant {args.tenant}')
+            account = directory.assign_tenant(args.user, args.tenant)
+            if account is None:
+                parser.error(f'unknown user {args.user}')
+            user_id, tenant_id = account
+            shards.get(tenant_id).add_member_user(user_id, args.user)
+            print(f'User {args.user} moved to {args.tenant}, existing data '
+                  'stays in the old database')
+        else:
+            for tenant_id, name, basefile in directory.tenant_list():
+                print(f'{tenant_id}\t{name}\t{basefile}')
+    finally:
+        shards.close()
+        directory.close()
+
+
+if __name__ == '__main__':
+    main()